@@ -4,26 +4,85 @@ import shutil
 import queue
 import threading
 import io
-import tempfile
-import subprocess
-import psutil
+import json
 import time
-from flask import Flask, request, jsonify, send_file, Response, stream_with_context
+from concurrent.futures import ThreadPoolExecutor
+import cv2
+import numpy as np
+from flask import Flask, g, request, jsonify, send_file, Response, stream_with_context
 from flask_cors import CORS
 from werkzeug.utils import secure_filename
 from PIL import Image
 
+from pipeline import (
+    CameliaPipeline, MODEL_TYPES, StageMetrics, apply_thread_budget, read_image, resolve_thread_budget
+)
+from result_cache import ResultCache, SessionCache
+from worker import PipelineWorker, PRIORITY_BATCH, PRIORITY_INTERACTIVE
+
 app = Flask(__name__, static_folder=None)
 CORS(app)  # Enable CORS for all routes
 
 WORKSPACE_ROOT = os.path.dirname(os.path.abspath(__file__))
 CAMELIA_TEMP = os.path.join(WORKSPACE_ROOT, "camelia-decensor", "temp")
 CAMELIA_OUTPUT = os.path.join(WORKSPACE_ROOT, "camelia-decensor", "output")
+CAMELIA_CACHE = os.environ.get("CAMELIA_CACHE_DIR", os.path.join(WORKSPACE_ROOT, "camelia-decensor", "cache"))
+# Size limit of the result cache in MB, 0 disables it
+CACHE_SIZE_MB = int(os.environ.get("CAMELIA_CACHE_SIZE_MB", "2048"))
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'webp'}
+MAX_CONCURRENT_JOBS = int(os.environ.get("CAMELIA_MAX_JOBS", "1"))
+SESSION_TTL = int(os.environ.get("CAMELIA_SESSION_TTL", str(24 * 3600)))
+# Cores are split between the concurrent jobs unless CAMELIA_THREADS sets the threads per job
+THREAD_BUDGET = resolve_thread_budget(
+    intra_op=int(os.environ.get("CAMELIA_THREADS", "0")),
+    inter_op=int(os.environ.get("CAMELIA_INTEROP_THREADS", "0")),
+    image_workers=MAX_CONCURRENT_JOBS
+)
 
 # Global dictionary to store process logs
 process_logs = {}
 process_status = {}
+process_jobs = {}
+# Last use of each session, and the requests currently running for it
+session_activity = {}
+active_requests = {}
+active_requests_lock = threading.Lock()
+
+# Download formats of /api/results, encoded once per result and kept under <output>/<session_id>/variants
+VARIANT_FORMATS = ('png', 'jpeg', 'webp')
+# Formats encoded in the background as soon as a result is written, e.g. "webp,jpeg"
+PREENCODE_FORMATS = [fmt.strip().lower() for fmt in os.environ.get("CAMELIA_PREENCODE_FORMATS", "").split(",")
+                     if fmt.strip().lower() in VARIANT_FORMATS]
+# Encoder settings of the download variants, the defaults keep downloads at full quality
+JPEG_QUALITY = int(os.environ.get("CAMELIA_JPEG_QUALITY", "100"))
+WEBP_QUALITY = int(os.environ.get("CAMELIA_WEBP_QUALITY", "100"))
+WEBP_METHOD = int(os.environ.get("CAMELIA_WEBP_METHOD", "6"))
+variant_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="camelia-variants")
+# Per session, one lock per variant or preview file; dropped with the session
+variant_locks = {}
+variant_locks_lock = threading.Lock()
+# Longest side of the gallery previews; (extension, cv2 encode params) per preview format
+PREVIEW_SIZE = int(os.environ.get("CAMELIA_PREVIEW_SIZE", "512"))
+PREVIEW_FORMATS = {
+    'jpeg': ('.jpg', [cv2.IMWRITE_JPEG_QUALITY, 85]),
+    'webp': ('.webp', [cv2.IMWRITE_WEBP_QUALITY, 80])
+}
+
+# Stage timings aggregated over all jobs, served by /api/metrics
+metrics = StageMetrics()
+
+# Results of previously processed uploads, keyed by content and settings
+result_cache = ResultCache(CAMELIA_CACHE, max_bytes=CACHE_SIZE_MB * 1024 ** 2) if CACHE_SIZE_MB > 0 else None
+
+# Decoded images, masks and outputs of recent sessions, so mask edits skip decoding and unchanged masks
+session_cache = SessionCache(
+    ttl=int(os.environ.get("CAMELIA_SESSION_CACHE_TTL", "1800")),
+    max_bytes=int(os.environ.get("CAMELIA_SESSION_CACHE_MB", "1024")) * 1024 ** 2
+)
+
+# Resident worker keeping the models loaded between jobs
+worker = None
+worker_lock = threading.Lock()
 
 def allowed_file(filename):
     """Check if the filename has an allowed extension."""
@@ -33,191 +92,299 @@ def ensure_directory(directory):
     """Ensure that a directory exists."""
     os.makedirs(directory, exist_ok=True)
 
-def clean_temp_dirs():
-    """Clean temporary directories while preserving the directory structure."""
-    # Clean images directory
-    images_dir = os.path.join(CAMELIA_TEMP, "images")
-    if os.path.exists(images_dir):
-        for root, dirs, files in os.walk(images_dir):
-            for file in files:
-                try:
-                    os.unlink(os.path.join(root, file))
-                except Exception as e:
-                    app.logger.error(f"Error removing file {os.path.join(root, file)}: {e}")
-    else:
-        ensure_directory(images_dir)
-    
-    # Clean masks directory
-    masks_dir = os.path.join(CAMELIA_TEMP, "masks")
-    if os.path.exists(masks_dir):
-        for root, dirs, files in os.walk(masks_dir):
-            for file in files:
-                try:
-                    os.unlink(os.path.join(root, file))
-                except Exception as e:
-                    app.logger.error(f"Error removing file {os.path.join(root, file)}: {e}")
-    else:
-        ensure_directory(masks_dir)
-    
-    # Clean any other files directly in the temp directory
-    for item in os.listdir(CAMELIA_TEMP):
-        item_path = os.path.join(CAMELIA_TEMP, item)
-        if os.path.isfile(item_path):
-            try:
-                os.unlink(item_path)
-            except Exception as e:
-                app.logger.error(f"Error removing file {item_path}: {e}")
-        elif os.path.isdir(item_path) and item not in ["images", "masks"]:
-            try:
-                shutil.rmtree(item_path)
-            except Exception as e:
-                app.logger.error(f"Error removing directory {item_path}: {e}")
+def get_session_temp(session_id):
+    """Per-session workspace holding the uploads and the intermediate images and masks."""
+    return os.path.join(CAMELIA_TEMP, session_id)
+
+def find_session_original(session_id, filename):
+    """Path of the uploaded original matching a result filename, ignoring the extension."""
+    uploads_dir = os.path.join(get_session_temp(secure_filename(session_id)), "uploads")
+    stem = os.path.splitext(secure_filename(filename))[0]
+    if os.path.isdir(uploads_dir):
+        for file in sorted(os.listdir(uploads_dir)):
+            if os.path.splitext(file)[0] == stem:
+                return os.path.join(uploads_dir, file)
+    return None
+
+def is_session_id(name):
+    """Check whether a directory name is a session ID generated by the API."""
+    try:
+        uuid.UUID(name)
+        return True
+    except ValueError:
+        return False
+
+def touch_session(session_id):
+    """
+    Mark a session as used now.
 
-def clear_output_directory(directory):
-    """Clear all contents from the specified output directory while preserving .keep files."""
-    if os.path.exists(directory):
-        for item in os.listdir(directory):
-            item_path = os.path.join(directory, item)
+    Expiry goes by the last use recorded here and by the mtime of the session
+    directories, which writes deeper in the tree (edits, variants, previews)
+    and plain reads do not update; the mtime keeps it across restarts.
+    """
+    if not is_session_id(session_id):
+        return
+    session_activity[session_id] = time.time()
+    for base_dir in (CAMELIA_TEMP, CAMELIA_OUTPUT):
+        try:
+            os.utime(os.path.join(base_dir, session_id))
+        except OSError:
+            pass
+
+@app.before_request
+def touch_requested_session():
+    """Every session-scoped request keeps its session from expiring while it runs and afterwards."""
+    session_id = (request.view_args or {}).get("session_id")
+    if session_id and is_session_id(session_id):
+        touch_session(session_id)
+        with active_requests_lock:
+            active_requests[session_id] = active_requests.get(session_id, 0) + 1
+        g.active_session = session_id
+
+@app.teardown_request
+def release_requested_session(exc=None):
+    session_id = g.pop("active_session", None)
+    if session_id is not None:
+        with active_requests_lock:
+            active_requests[session_id] -= 1
+            if not active_requests[session_id]:
+                del active_requests[session_id]
+
+def is_session_busy(session_id):
+    """Whether a session has a queued or running job, or a request (e.g. a reinpaint) in flight."""
+    job = process_jobs.get(session_id)
+    with active_requests_lock:
+        in_flight = session_id in active_requests
+    return process_status.get(session_id) == "processing" or (job is not None and not job.done()) or in_flight
+
+def forget_session(session_id):
+    """Drop every in-memory trace of a session."""
+    process_logs.pop(session_id, None)
+    process_status.pop(session_id, None)
+    process_jobs.pop(session_id, None)
+    session_activity.pop(session_id, None)
+    session_cache.drop_session(session_id)
+    with variant_locks_lock:
+        variant_locks.pop(session_id, None)
+    app.config.pop(f"results_{session_id}", None)
+
+def clean_expired_sessions():
+    """Delete session workspaces, results and state unused for SESSION_TTL, skipping busy sessions."""
+    now = time.time()
+    expired = set()
+    for base_dir in (CAMELIA_TEMP, CAMELIA_OUTPUT):
+        if not os.path.exists(base_dir):
+            continue
+        for item in os.listdir(base_dir):
+            item_path = os.path.join(base_dir, item)
+            if not os.path.isdir(item_path) or not is_session_id(item) or is_session_busy(item):
+                continue
             try:
-                if os.path.isfile(item_path):
-                    if os.path.basename(item_path) != ".keep":
-                        os.unlink(item_path)
-                elif os.path.isdir(item_path):
-                    for root, dirs, files in os.walk(item_path, topdown=False):
-                        for file in files:
-                            file_path = os.path.join(root, file)
-                            if os.path.basename(file_path) != ".keep":
-                                os.unlink(file_path)
-                        for dir in dirs:
-                            dir_path = os.path.join(root, dir)
-                            dir_contents = os.listdir(dir_path)
-                            if not dir_contents or (len(dir_contents) == 1 and ".keep" in dir_contents):
-                                pass
-                            else:
-                                try:
-                                    os.rmdir(dir_path)
-                                except OSError:
-                                    pass
+                if now - max(os.path.getmtime(item_path), session_activity.get(item, 0)) > SESSION_TTL:
+                    shutil.rmtree(item_path)
+                    expired.add(item)
             except Exception as e:
-                app.logger.error(f"Error handling {item_path}: {e}")
-        
-        os.makedirs(directory, exist_ok=True)
-        return True
-    return False
+                app.logger.error(f"Error removing expired session {item_path}: {e}")
+
+    # State of sessions whose directories were never created or are already gone
+    for session_id in set(process_status) | set(session_activity):
+        if session_id in expired or is_session_busy(session_id):
+            continue
+        if any(os.path.exists(os.path.join(base_dir, session_id)) for base_dir in (CAMELIA_TEMP, CAMELIA_OUTPUT)):
+            continue
+        if now - session_activity.get(session_id, 0) > SESSION_TTL:
+            expired.add(session_id)
+
+    for session_id in expired:
+        forget_session(session_id)
+
+def get_variant_path(filepath, output_format):
+    """Path of the encoded output_format variant of a result file."""
+    stem = os.path.splitext(os.path.basename(filepath))[0]
+    return os.path.join(os.path.dirname(filepath), "variants", f"{stem}.{output_format}")
+
+def get_variant_lock(path):
+    """Lock serializing the encodes of one variant or preview file of a session output directory."""
+    session_id = os.path.relpath(path, CAMELIA_OUTPUT).split(os.sep)[0]
+    with variant_locks_lock:
+        return variant_locks.setdefault(session_id, {}).setdefault(path, threading.Lock())
+
+def ensure_variant(filepath, output_format):
+    """
+    Encode a result to output_format once and return the path of the variant.
+
+    The variant is reused until the result is written again (mask edits
+    overwrite their result), and concurrent requests for the same variant
+    wait for a single encode.
+    """
+    variant_path = get_variant_path(filepath, output_format)
+    with get_variant_lock(variant_path):
+        if os.path.exists(variant_path) and os.path.getmtime(variant_path) >= os.path.getmtime(filepath):
+            return variant_path
+
+        img = Image.open(filepath)
+        if output_format == 'jpeg':
+            if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
+                background = Image.new('RGB', img.size, (255, 255, 255))
+                background.paste(img, mask=img.split()[3] if img.mode == 'RGBA' else None)
+                img = background
+            save_kwargs = {'quality': JPEG_QUALITY, 'optimize': True}
+        elif output_format == 'webp':
+            save_kwargs = {'quality': WEBP_QUALITY, 'method': WEBP_METHOD}
+        else:
+            save_kwargs = {}
+
+        ensure_directory(os.path.dirname(variant_path))
+        # Encoded to a temporary name so a concurrent reader never serves a partial file
+        partial_path = f"{variant_path}.{uuid.uuid4().hex}.tmp"
+        try:
+            img.save(partial_path, format=output_format.upper(), **save_kwargs)
+            os.replace(partial_path, variant_path)
+        finally:
+            if os.path.exists(partial_path):
+                os.remove(partial_path)
+        return variant_path
+
+def preencode_variants(filepath):
+    """Encode the PREENCODE_FORMATS variants of a new result in the background."""
+    for output_format in PREENCODE_FORMATS:
+        if output_format == 'png' and filepath.lower().endswith('.png'):
+            continue
+        future = variant_executor.submit(ensure_variant, filepath, output_format)
+        future.add_done_callback(
+            lambda f: f.exception() and app.logger.error(f"Error encoding variant: {f.exception()}")
+        )
+
+def get_preview_path(session_id, filename, output_format, original=False):
+    """Path of the preview of a result, or of its original image."""
+    stem = os.path.splitext(secure_filename(filename))[0] + (".original" if original else "")
+    return os.path.join(CAMELIA_OUTPUT, session_id, "previews", stem + PREVIEW_FORMATS[output_format][0])
+
+def write_preview(preview_path, image, output_format='jpeg'):
+    """Downscale an RGB array to at most PREVIEW_SIZE pixels per side and encode it to preview_path."""
+    h, w = image.shape[:2]
+    scale = PREVIEW_SIZE / max(h, w)
+    if scale < 1:
+        image = cv2.resize(image, (max(1, round(w * scale)), max(1, round(h * scale))), interpolation=cv2.INTER_AREA)
+    extension, params = PREVIEW_FORMATS[output_format]
+    ok, data = cv2.imencode(extension, cv2.cvtColor(image, cv2.COLOR_RGB2BGR), params)
+    if not ok:
+        raise ValueError(f"Failed to encode {output_format} preview")
+
+    ensure_directory(os.path.dirname(preview_path))
+    partial_path = f"{preview_path}.{uuid.uuid4().hex}.tmp"
+    try:
+        with open(partial_path, 'wb') as f:
+            f.write(data.tobytes())
+        os.replace(partial_path, preview_path)
+    finally:
+        if os.path.exists(partial_path):
+            os.remove(partial_path)
+
+def ensure_preview(source_path, preview_path, output_format):
+    """Return preview_path, encoding it from source_path first if it is missing or older."""
+    with get_variant_lock(preview_path):
+        if not os.path.exists(preview_path) or os.path.getmtime(preview_path) < os.path.getmtime(source_path):
+            write_preview(preview_path, read_image(source_path), output_format)
+    return preview_path
+
+def send_cached_file(filepath, **kwargs):
+    """
+    Send a file with ETag and Last-Modified validators.
+
+    Clients must revalidate (results of mask edits are overwritten in place),
+    but an unchanged file is answered with 304 Not Modified.
+    """
+    response = send_file(filepath, conditional=True, etag=True, last_modified=os.path.getmtime(filepath), **kwargs)
+    response.cache_control.no_cache = True
+    return response
+
+def get_worker():
+    """Return the resident pipeline worker, starting it on first use."""
+    global worker
+    with worker_lock:
+        if worker is None:
+            apply_thread_budget(THREAD_BUDGET, log=app.logger.info)
+            worker = PipelineWorker(
+                log=app.logger.info,
+                max_jobs=MAX_CONCURRENT_JOBS,
+                inpaint_options={
+                    "batch_size": int(os.environ.get("CAMELIA_INPAINT_BATCH_SIZE", "1")),
+                    "fft_friendly": os.environ.get("CAMELIA_FFT_FRIENDLY", "0") == "1",
+                    "buckets": [int(size) for size in os.environ.get("CAMELIA_INPAINT_BUCKETS", "").split(",")
+                                if size.strip()],
+                    "max_crop_size": int(os.environ.get("CAMELIA_INPAINT_MAX_SIZE", "0")) or None,
+                    "detail_strength": float(os.environ.get("CAMELIA_DETAIL_STRENGTH", "0")),
+                    "refine": os.environ.get("CAMELIA_REFINE", "0") == "1",
+                    "refine_min_size": int(os.environ.get("CAMELIA_REFINE_MIN_SIZE", "768")),
+                    "refine_time_budget": float(os.environ.get("CAMELIA_REFINE_TIME_BUDGET", "10")) or None
+                },
+                tile_options={} if os.environ.get("CAMELIA_TILED_SEGMENTATION", "0") == "1" else None,
+                precision=os.environ.get("CAMELIA_PRECISION", "fp32"),
+                channels_last=os.environ.get("CAMELIA_CHANNELS_LAST", "0") == "1",
+                segment_batch_size=int(os.environ.get("CAMELIA_SEGMENT_BATCH_SIZE", "1")),
+                result_cache=result_cache
+            )
+        return worker
 
-def process_images(image_paths, model_type, session_id):
-    """Process images using the existing Camelia functionality and capture logs."""
-    # Create temporary directories
-    images_dir = os.path.join(CAMELIA_TEMP, "images")
-    masks_dir = os.path.join(CAMELIA_TEMP, "masks")
+def process_images(pipeline, uploads, model_type, session_id):
+    """
+    Process uploaded images with the resident pipeline and capture logs.
+
+    Uploads are (filename, bytes) pairs decoded once in memory. Every result is
+    added to the session and announced on the log stream as soon as it is written.
+    """
     output_dir = os.path.join(CAMELIA_OUTPUT, session_id)
     
-    ensure_directory(images_dir)
-    ensure_directory(masks_dir)
     ensure_directory(output_dir)
     
-    # Clean temp directories before processing
-    clean_temp_dirs()
-    
-    # Clear output directory before processing
-    clear_output_directory(CAMELIA_OUTPUT)
+    results = app.config.setdefault(f"results_{session_id}", [])
     
-    # Copy images to the input directory with the selected model type
-    model_dir = os.path.join(WORKSPACE_ROOT, "camelia-decensor", "input", model_type)
-    ensure_directory(model_dir)
+    items = []
+    for filename, data in uploads:
+        items.append((data, os.path.splitext(filename)[0] + '.png'))
+        process_logs[session_id].put(f"Prepared {filename} for processing")
     
-    # Clean previous files
-    for file in os.listdir(model_dir):
-        file_path = os.path.join(model_dir, file)
-        if os.path.isfile(file_path) and file != ".keep":
-            os.unlink(file_path)
-    
-    # Copy uploaded images to the model directory
-    for image_path in image_paths:
-        filename = os.path.basename(image_path)
-        dst_path = os.path.join(model_dir, filename)
-        shutil.copyfile(image_path, dst_path)
-        process_logs[session_id].put(f"Prepared {filename} to input directory")
+    def on_result(filename, dst_path):
+        results.append({
+            "filename": filename,
+            "processed_path": dst_path
+        })
+        preencode_variants(dst_path)
+        process_logs[session_id].put(f"Saved processed file: {filename}")
+        process_logs[session_id].put({"event": "result", "data": {"filename": filename}})
     
-    env = os.environ.copy()
-    env['PYTHONUNBUFFERED'] = '1' 
-    env['PYTHONIOENCODING'] = 'UTF-8'
+    def on_event(event):
+        metrics.record(event)
+        process_logs[session_id].put({"event": "progress", "data": event})
     
-    cmd = [
-        "python",
-        "-u", 
-        os.path.join(WORKSPACE_ROOT, "main.py"),
-        "--model_type", model_type
-    ]
+    def on_image(filename, image, mask, output, region_results):
+        session_cache.put(session_id, os.path.splitext(filename)[0], image, mask, output, region_results)
+        # The gallery previews come straight from the arrays, without decoding the files again.
+        # A failed preview is generated on request instead, it must not fail the image.
+        try:
+            write_preview(get_preview_path(session_id, filename, 'jpeg'), output)
+            write_preview(get_preview_path(session_id, filename, 'jpeg', original=True), image)
+        except Exception as e:
+            app.logger.error(f"Error writing previews of {filename}: {e}")
     
     try:
         process_logs[session_id].put(f"Starting image processing with {model_type}")
         
-        # Use Popen to capture output
-        process = subprocess.Popen(
-            cmd,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True,
-            bufsize=1,
-            universal_newlines=True,
-            env=env
+        pipeline.process_files(
+            items,
+            output_dir=output_dir,
+            model_type=model_type,
+            should_stop=lambda: process_status.get(session_id) == "cancelled",
+            log=process_logs[session_id].put,
+            on_result=on_result,
+            on_event=on_event,
+            on_image=on_image
         )
         
-        # Create a thread to read output in real-time
-        def read_output():
-            for line in iter(process.stdout.readline, ''):
-                if line.strip():
-                    process_logs[session_id].put(line.strip())
-                    time.sleep(0.01)
-            process.stdout.close()
-            
-        # Start the output reader thread
-        output_thread = threading.Thread(target=read_output)
-        output_thread.daemon = True
-        output_thread.start()
-        
-        return_code = process.wait()
-        
-        output_thread.join(timeout=5.0)
-        
-        if return_code != 0:
-            process_logs[session_id].put(f"Process exited with error code {return_code}")
-            process_status[session_id] = "error"
+        if process_status.get(session_id) == "cancelled":
             return None, []
         
-        results = []
-        
-        process_logs[session_id].put("Processing completed. Collecting results...")
-        
-        # Move output files to session directory
-        for file in os.listdir(CAMELIA_OUTPUT):
-            file_path = os.path.join(CAMELIA_OUTPUT, file)
-            if os.path.isfile(file_path) and file.endswith(tuple(ALLOWED_EXTENSIONS)):
-                dst_path = os.path.join(output_dir, file)
-                shutil.move(file_path, dst_path)
-                results.append({
-                    "filename": file,
-                    "processed_path": dst_path
-                })
-                process_logs[session_id].put(f"Saved processed file: {file}")
-        
-        # Check the temp/images directory
-        if not results:
-            process_logs[session_id].put("No results found in output directory. Checking temporary directories...")
-            temp_images_dir = os.path.join(CAMELIA_TEMP, "images")
-            if os.path.exists(temp_images_dir):
-                for file in os.listdir(temp_images_dir):
-                    if file.endswith(tuple(ALLOWED_EXTENSIONS)):
-                        src_path = os.path.join(temp_images_dir, file)
-                        dst_path = os.path.join(output_dir, file)
-                        shutil.copy(src_path, dst_path)
-                        results.append({
-                            "filename": file,
-                            "processed_path": dst_path
-                        })
-                        process_logs[session_id].put(f"Copied temporary file as result: {file}")
-        
         if not results:
             process_logs[session_id].put("Error: No result files were found")
             process_status[session_id] = "error"
@@ -234,13 +401,10 @@ def process_images(image_paths, model_type, session_id):
         process_status[session_id] = "error"
         return None, []
 
-def process_images_thread(image_paths, model_type, session_id):
-    """Run the image processing in a separate thread."""
+def process_images_job(pipeline, uploads, model_type, session_id):
+    """Run the image processing as a job on the worker pool."""
     try:
-        session_id, results = process_images(image_paths, model_type, session_id)
-        
-        if session_id and results:
-            app.config[f"results_{session_id}"] = results
+        process_images(pipeline, uploads, model_type, session_id)
             
         process_logs[session_id].put("Job finished")
     except Exception as e:
@@ -262,7 +426,7 @@ def process():
     
     # Get model type from form data
     model_type = request.form.get('model_type', 'transparent_black')
-    if model_type not in ['black_bars', 'white_bars', 'transparent_black']:
+    if model_type not in MODEL_TYPES:
         return jsonify({"error": "Invalid model type"}), 400
     
     # Generate a session ID
@@ -270,29 +434,36 @@ def process():
     process_logs[session_id] = queue.Queue()
     process_status[session_id] = "processing"
     
-    temp_dir = tempfile.mkdtemp()
-    saved_paths = []
+    clean_expired_sessions()
+    
+    temp_dir = os.path.join(get_session_temp(session_id), "uploads")
+    ensure_directory(temp_dir)
+    touch_session(session_id)
+    uploads = []
     
     try:
         for file in files:
             if file and allowed_file(file.filename):
                 filename = secure_filename(file.filename)
-                filepath = os.path.join(temp_dir, filename)
-                file.save(filepath)
-                saved_paths.append(filepath)
+                data = file.read()
+                # Kept as-is for /api/original and mask edits, processing uses the bytes in memory
+                with open(os.path.join(temp_dir, filename), 'wb') as f:
+                    f.write(data)
+                uploads.append((filename, data))
         
-        if not saved_paths:
+        if not uploads:
             process_logs[session_id].put("No valid image files provided")
             process_status[session_id] = "error"
             return jsonify({"error": "No valid image files provided"}), 400
         
-        # Start processing in a separate thread
-        process_thread = threading.Thread(
-            target=process_images_thread,
-            args=(saved_paths, model_type, session_id)
+        # Queue the job, it starts as soon as a worker is free
+        job_worker = get_worker()
+        waiting = job_worker.pending()
+        process_jobs[session_id] = job_worker.submit(
+            process_images_job, uploads, model_type, session_id, priority=PRIORITY_BATCH
         )
-        process_thread.daemon = True
-        process_thread.start()
+        if waiting:
+            process_logs[session_id].put(f"Queued behind {waiting} job(s)")
         
         # Return session ID
         return jsonify({
@@ -317,8 +488,8 @@ def get_status(session_id):
         
     status = process_status[session_id]
     
-    # If processing is complete, include results
-    if status == "completed" and f"results_{session_id}" in app.config:
+    # Include the results finished so far, they are available before the whole batch completes
+    if status in ("completed", "processing") and f"results_{session_id}" in app.config:
         results = app.config[f"results_{session_id}"]
         return jsonify({
             "status": status,
@@ -337,21 +508,28 @@ def stream_logs(session_id):
     if session_id not in process_logs:
         return jsonify({"error": "Session not found"}), 404
     
+    def format_event(log_message):
+        # Plain strings are log lines, dicts are named events with a JSON payload
+        if isinstance(log_message, dict):
+            return f"event: {log_message['event']}\ndata: {json.dumps(log_message['data'])}\n\n"
+        return f"data: {log_message}\n\n"
+    
     def generate():
         log_queue = process_logs[session_id]
         
         # Send any existing logs
         while not log_queue.empty():
             log_message = log_queue.get()
-            yield f"data: {log_message}\n\n"
+            yield format_event(log_message)
         
         # Stream new logs as they come in
         while session_id in process_status and process_status[session_id] in ["processing", "starting"]:
             try:
                 try:
-                    log = log_queue.get(timeout=0.1)
+                    # Every status change is followed by a log message, so a long wait is safe
+                    log = log_queue.get(timeout=1.0)
                     if log:
-                        yield f"data: {log}\n\n"
+                        yield format_event(log)
                 except queue.Empty:
                     yield f": keep-alive\n\n"
             except Exception as e:
@@ -361,7 +539,7 @@ def stream_logs(session_id):
         # Send any remaining logs
         while not log_queue.empty():
             log_message = log_queue.get()
-            yield f"data: {log_message}\n\n"
+            yield format_event(log_message)
         
         # Send completion message
         if session_id in process_status:
@@ -373,6 +551,21 @@ def stream_logs(session_id):
     response.headers['X-Accel-Buffering'] = 'no'
     return response
 
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """Aggregate per-stage timings and job counters across all sessions."""
+    snapshot = metrics.snapshot()
+    snapshot["jobs"] = {
+        "processing": sum(1 for status in list(process_status.values()) if status == "processing"),
+        "queued": worker.pending() if worker is not None else 0,
+        "max_concurrent": MAX_CONCURRENT_JOBS,
+        "threads_per_job": THREAD_BUDGET.intra_op
+    }
+    if result_cache is not None:
+        snapshot["cache"] = result_cache.stats()
+    snapshot["session_cache"] = session_cache.stats()
+    return jsonify(snapshot)
+
 @app.route('/api/results/<session_id>/<filename>', methods=['GET'])
 def get_result(session_id, filename):
     """API endpoint to get a processed image."""
@@ -387,47 +580,78 @@ def get_result(session_id, filename):
         return jsonify({"error": "File not found"}), 404
     
     if not output_format:
-        return send_file(filepath)
+        return send_cached_file(filepath)
     
-    if output_format.lower() not in ['png', 'jpeg', 'webp']:
+    output_format = output_format.lower()
+    if output_format not in VARIANT_FORMATS:
         return jsonify({"error": "Invalid format requested"}), 400
+    if output_format == 'png' and filepath.lower().endswith('.png'):
+        # Results are written as PNG already
+        return send_cached_file(filepath)
         
     try:
-        img = Image.open(filepath)
-        
-        output_buffer = io.BytesIO()
-        
-        if output_format.lower() == 'jpeg':
-            if img.mode in ('RGBA', 'LA') or (img.mode == 'P' and 'transparency' in img.info):
-                background = Image.new('RGB', img.size, (255, 255, 255))
-                background.paste(img, mask=img.split()[3] if img.mode == 'RGBA' else None)
-                img = background
-            img.save(output_buffer, format='JPEG', quality=100, optimize=True)
-        elif output_format.lower() == 'webp':
-            img.save(output_buffer, format='WEBP', quality=100, method=6)
-        else:
-            img.save(output_buffer, format=output_format.upper())
-            
-        output_buffer.seek(0)
-        
-        mimetype = f'image/{output_format.lower()}'
-        if output_format.lower() == 'jpeg':
-            mimetype = 'image/jpeg'
-            
-        return send_file(
-            output_buffer,
-            mimetype=mimetype,
+        variant_path = ensure_variant(filepath, output_format)
+        return send_cached_file(
+            variant_path,
+            mimetype=f'image/{output_format}',
             as_attachment=False,
-            download_name=f"{os.path.splitext(filename)[0]}.{output_format.lower()}"
+            download_name=f"{os.path.splitext(filename)[0]}.{output_format}"
         )
         
     except Exception as e:
         app.logger.error(f"Error converting image: {e}")
         return jsonify({"error": f"Error converting image: {str(e)}"}), 500
 
+@app.route('/api/preview/<session_id>/<filename>', methods=['GET'])
+def get_result_preview(session_id, filename):
+    """API endpoint to get a downscaled JPEG (or ?format=webp) preview of a processed image."""
+    return send_preview(session_id, filename, original=False)
+
+@app.route('/api/preview/original/<session_id>/<filename>', methods=['GET'])
+def get_original_preview(session_id, filename):
+    """API endpoint to get a downscaled preview of the original image of a session."""
+    return send_preview(session_id, filename, original=True)
+
+def send_preview(session_id, filename, original):
+    """Send a preview, generating it from the full-size file the first time it is requested."""
+    if '..' in session_id or '..' in filename:
+        return jsonify({"error": "Invalid path"}), 400
+    
+    output_format = request.args.get('format', 'jpeg').lower()
+    if output_format not in PREVIEW_FORMATS:
+        return jsonify({"error": "Invalid format requested"}), 400
+    
+    if original:
+        source_path = find_session_original(session_id, filename)
+    else:
+        source_path = os.path.join(CAMELIA_OUTPUT, session_id, secure_filename(filename))
+    if source_path is None or not os.path.exists(source_path):
+        return jsonify({"error": "File not found"}), 404
+    
+    try:
+        preview_path = ensure_preview(source_path, get_preview_path(session_id, filename, output_format, original),
+                                      output_format)
+        return send_cached_file(preview_path, mimetype=f'image/{output_format}')
+    except Exception as e:
+        app.logger.error(f"Error creating preview: {e}")
+        return jsonify({"error": f"Error creating preview: {str(e)}"}), 500
+
+@app.route('/api/original/<session_id>/<filename>', methods=['GET'])
+def get_session_original(session_id, filename):
+    """API endpoint to get the original image of a session (for comparison)."""
+    if '..' in session_id or '..' in filename:
+        return jsonify({"error": "Invalid path"}), 400
+    
+    filepath = find_session_original(session_id, filename)
+    
+    if filepath is None:
+        return jsonify({"error": "File not found"}), 404
+    
+    return send_cached_file(filepath)
+
 @app.route('/api/original/<filename>', methods=['GET'])
 def get_original(filename):
-    """API endpoint to get the original image (for comparison)."""
+    """API endpoint to get an original image from the shared CLI temp directory."""
     if '..' in filename:
         return jsonify({"error": "Invalid path"}), 400
     
@@ -436,7 +660,7 @@ def get_original(filename):
     if not os.path.exists(filepath):
         return jsonify({"error": "File not found"}), 404
     
-    return send_file(filepath)
+    return send_cached_file(filepath)
 
 @app.route('/api/reinpaint/<session_id>/<filename>', methods=['POST'])
 def reinpaint(session_id, filename):
@@ -446,46 +670,46 @@ def reinpaint(session_id, filename):
 
     mask_file = request.files['mask']
     safe_name = secure_filename(filename)
-    image_path = os.path.join(CAMELIA_TEMP, 'images', safe_name)
+    stem = os.path.splitext(safe_name)[0]
+    cached = session_cache.get(session_id, stem)
+    image_path = None if cached is not None else find_session_original(session_id, safe_name)
 
-    if not os.path.exists(image_path):
+    if cached is None and image_path is None:
         return jsonify({'success': False, 'error': 'Image not found'}), 404
 
     try:
-        with tempfile.TemporaryDirectory() as in_dir, \
-                tempfile.TemporaryDirectory() as mask_dir, \
-                tempfile.TemporaryDirectory() as out_dir:
-
-            shutil.copy(image_path, os.path.join(in_dir, safe_name))
-            mask_save = os.path.join(mask_dir, safe_name)
-            mask_file.save(mask_save)
-
-            from main import run_inpainting
-
-            success = run_inpainting(
-                in_dir=in_dir,
-                mask_dir=mask_dir,
-                out_dir=out_dir,
-                checkpoint=os.path.join(WORKSPACE_ROOT, 'lama-inpainting', 'pretrained', 'best'),
-                inpainting_script=os.path.join(WORKSPACE_ROOT, 'lama-inpainting', 'bin', 'uncen.py'),
-                workspace_root=WORKSPACE_ROOT
-            )
+        image = cached.image if cached is not None else read_image(image_path)
+        mask = cv2.imdecode(np.frombuffer(mask_file.read(), np.uint8), cv2.IMREAD_GRAYSCALE)
+        if mask is None:
+            return jsonify({'success': False, 'error': 'Invalid mask'}), 400
+        if mask.shape != image.shape[:2]:
+            return jsonify({'success': False, 'error': 'Mask size does not match the image'}), 400
 
-            if not success:
-                return jsonify({'success': False, 'error': 'Inpainting failed'}), 500
+        stats = {}
+        if cached is not None and np.array_equal(mask, cached.mask):
+            # Nothing to inpaint again, the previous output is still valid
+            output, region_results = cached.output, cached.regions
+        else:
+            # Regions the edit did not touch are reused, only the changed ones are inpainted
+            region_results = dict(cached.regions or {}) if cached is not None else {}
+            output, _ = get_worker().run(CameliaPipeline.inpaint, image, mask, stats=stats,
+                                         region_results=region_results, priority=PRIORITY_INTERACTIVE)
+        session_cache.put(session_id, stem, image, mask, output, region_results)
 
-            new_name = f"{os.path.splitext(safe_name)[0]}_edit{os.path.splitext(safe_name)[1]}"
-            session_dir = os.path.join(CAMELIA_OUTPUT, session_id)
-            ensure_directory(session_dir)
-            src = os.path.join(out_dir, safe_name)
-            dst = os.path.join(session_dir, new_name)
-            shutil.move(src, dst)
+        new_name = f"{os.path.splitext(safe_name)[0]}_edit{os.path.splitext(safe_name)[1]}"
+        session_dir = os.path.join(CAMELIA_OUTPUT, session_id)
+        ensure_directory(session_dir)
+        dst = os.path.join(session_dir, new_name)
+        cv2.imwrite(dst, cv2.cvtColor(output, cv2.COLOR_RGB2BGR))
+        preencode_variants(dst)
+        write_preview(get_preview_path(session_id, new_name, 'jpeg'), output)
 
         key = f"results_{session_id}"
         if key in app.config:
             app.config[key].append({'filename': new_name, 'processed_path': dst})
 
-        return jsonify({'success': True, 'filename': new_name})
+        return jsonify({'success': True, 'filename': new_name, 'regions': stats.get('regions'),
+                        'reused_regions': stats.get('reused_regions')})
     except Exception as e:
         app.logger.error(f"Reinpaint error: {e}")
         return jsonify({'success': False, 'error': 'Internal server error'}), 500
@@ -500,19 +724,11 @@ def cancel_job(session_id):
         if process_status[session_id] == "processing":
             process_logs[session_id].put("Job cancellation requested by user")
             
+            # Queued jobs are dropped, running ones stop at the next image
             process_status[session_id] = "cancelled"
-            
-            for process in psutil.process_iter(['pid', 'name', 'cmdline']):
-                try:
-                    if process.info['cmdline'] and len(process.info['cmdline']) > 2:
-                        cmd = ' '.join(process.info['cmdline'])
-                        # Check if this is the main.py process for this session
-                        if 'python' in cmd and 'main.py' in cmd and f'--model_type' in cmd:
-                            # Kill the process
-                            process.terminate()
-                            process_logs[session_id].put(f"Process {process.info['pid']} terminated")
-                except (psutil.NoSuchProcess, psutil.AccessDenied, psutil.ZombieProcess):
-                    continue
+            job = process_jobs.get(session_id)
+            if job is not None and job.cancel():
+                process_logs[session_id].put("Job removed from queue")
             
             process_logs[session_id].put("Job cancelled successfully.")
             
@@ -537,4 +753,12 @@ if __name__ == '__main__':
     # Ensure output directories exist
     ensure_directory(CAMELIA_TEMP)
     ensure_directory(CAMELIA_OUTPUT)
+    
+    # Load the models in the background so the first job does not pay for it.
+    # With debug=True only the reloader's child process serves requests.
+    if os.environ.get("CAMELIA_PRELOAD", "1") != "0" and os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        preload = get_worker().preload(warmup=os.environ.get("CAMELIA_WARMUP", "1") != "0")
+        preload.add_done_callback(
+            lambda f: f.exception() and app.logger.error(f"Model preload failed: {f.exception()}")
+        )
     app.run(host='0.0.0.0', port=int(os.environ.get("API_PORT", "5000")), debug=True)
@@ -13,6 +13,8 @@ export interface ResultItem {
     sessionId: string;
     original: string;
     processed: string;
+    originalPreview: string;
+    processedPreview: string;
 }
 
 export interface ApiResponse {
@@ -85,12 +87,23 @@ export async function checkProcessingStatus(sessionId: string): Promise<{
 }
 
 /**
- * Stream logs from the processing job
+ * Stream logs from the processing job. `onResult` is called as soon as each
+ * image is finished, before the whole batch completes.
  */
-export function streamProcessingLogs(sessionId: string, onLog: (log: string) => void): () => void {
+export function streamProcessingLogs(
+    sessionId: string,
+    onLog: (log: string) => void,
+    onResult?: (result: { filename: string }) => void
+): () => void {
     const API_BASE_URL = getApiBaseUrl();
     const evtSource = new EventSource(`${API_BASE_URL}/logs/${sessionId}`);
 
+    evtSource.addEventListener('result', (event) => {
+        if (onResult) {
+            onResult(JSON.parse((event as MessageEvent).data));
+        }
+    });
+
     evtSource.onmessage = (event) => {
         if (event.data && event.data.trim()) {
             onLog(event.data);
@@ -121,8 +134,10 @@ export function transformResults(
         return {
             filename: result.filename,
             sessionId,
-            original: `${API_BASE_URL}/original/${result.filename}`,
-            processed: `${API_BASE_URL}/results/${sessionId}/${result.filename}`
+            original: `${API_BASE_URL}/original/${sessionId}/${result.filename}`,
+            processed: `${API_BASE_URL}/results/${sessionId}/${result.filename}`,
+            originalPreview: `${API_BASE_URL}/preview/original/${sessionId}/${result.filename}`,
+            processedPreview: `${API_BASE_URL}/preview/${sessionId}/${result.filename}`
         };
     });
 }
@@ -179,7 +194,9 @@ export async function reinpaintImage(
     return {
         filename: data.filename,
         sessionId,
-        original: `${API_BASE_URL}/original/${filename}`,
-        processed: `${API_BASE_URL}/results/${sessionId}/${data.filename}`
+        original: `${API_BASE_URL}/original/${sessionId}/${filename}`,
+        processed: `${API_BASE_URL}/results/${sessionId}/${data.filename}`,
+        originalPreview: `${API_BASE_URL}/preview/original/${sessionId}/${filename}`,
+        processedPreview: `${API_BASE_URL}/preview/${sessionId}/${data.filename}`
     };
 }
@@ -0,0 +1,70 @@
+from argparse import ArgumentParser
+import time
+
+import torch
+
+from generator import load_inpaint_model
+from uncen import fft_size
+
+
+def factorize(n):
+    factors = []
+    p = 2
+    while p * p <= n:
+        while n % p == 0:
+            factors.append(p)
+            n //= p
+        p += 1
+    if n > 1:
+        factors.append(n)
+    return factors
+
+
+def time_size(model, size, device, repeats):
+    """Mean latency in ms of one generator pass over a size x size crop, after one untimed pass."""
+    batch = dict(image=torch.rand(1, 3, size, size, device=device),
+                 mask=(torch.rand(1, 1, size, size, device=device) > 0.5) * 1)
+    with torch.no_grad():
+        model(dict(batch))
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+        start = time.perf_counter()
+        for _ in range(repeats):
+            model(dict(batch))
+        if device.type == 'cuda':
+            torch.cuda.synchronize(device)
+    return (time.perf_counter() - start) * 1000 / repeats
+
+
+def main():
+    parser = ArgumentParser(description='Per-size latency of the inpainting generator, plain vs FFT-friendly crop sizes.')
+    parser.add_argument('--checkpoint', required=True, help='Checkpoint dir')
+    parser.add_argument('--device', default='cpu', help='Device used for inference')
+    parser.add_argument('--sizes', type=int, nargs='*', default=None, help='Crop sizes to time (multiples of 8)')
+    parser.add_argument('--min_size', type=int, default=256, help='Smallest crop size when --sizes is not given')
+    parser.add_argument('--max_size', type=int, default=1280, help='Largest crop size when --sizes is not given')
+    parser.add_argument('--step', type=int, default=40, help='Size step when --sizes is not given (rounded to 8)')
+    parser.add_argument('--repeats', type=int, default=3, help='Timed runs per size')
+    args = parser.parse_args()
+
+    device = torch.device(args.device)
+    model = load_inpaint_model(args.checkpoint)
+    model.to(device)
+
+    step = max(8, args.step // 8 * 8)
+    sizes = args.sizes or list(range(args.min_size // 8 * 8, args.max_size + 1, step))
+    timings = {}
+
+    print(f"{'size':>6} {'size/8 factors':>18} {'ms':>9} {'fft size':>9} {'fft ms':>9} {'speedup':>8}")
+    for size in sizes:
+        padded = fft_size(size)
+        for s in (size, padded):
+            if s not in timings:
+                timings[s] = time_size(model, s, device, args.repeats)
+        factors = 'x'.join(str(f) for f in factorize(size // 8)) if size >= 16 else str(size // 8)
+        print(f'{size:>6} {factors:>18} {timings[size]:>9.1f} {padded:>9} {timings[padded]:>9.1f} '
+              f'{timings[size] / timings[padded]:>7.2f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+from argparse import ArgumentParser
+import sys
+import time
+
+import torch
+
+from saicinpainting.training.modules.ffc import FourierUnit
+
+# (channels, groups, FourierUnit kwargs)
+CONFIGS = [
+    (64, 1, {}),
+    (64, 2, {}),
+    (32, 1, {'spectral_pos_encoding': True}),
+    (32, 1, {'use_se': True}),
+    (32, 1, {'spatial_scale_factor': 0.5}),
+]
+SIZES = [(64, 64), (63, 97), (128, 40)]
+
+
+def make_unit(channels, groups, kwargs):
+    """FourierUnit with random weights and non-trivial BatchNorm statistics, in eval mode."""
+    unit = FourierUnit(channels, channels, groups, **kwargs)
+    with torch.no_grad():
+        unit.bn.running_mean.uniform_(-0.5, 0.5)
+        unit.bn.running_var.uniform_(0.5, 2)
+        unit.bn.weight.uniform_(0.5, 1.5)
+        unit.bn.bias.uniform_(-0.5, 0.5)
+    return unit.eval()
+
+
+def run_reference(module, x):
+    FourierUnit.use_fast_inference = False
+    try:
+        return module(x)
+    finally:
+        FourierUnit.use_fast_inference = True
+
+
+def timed(fn, repeats):
+    fn()
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) * 1000 / repeats
+
+
+def check_units(atol):
+    ok = True
+    for channels, groups, kwargs in CONFIGS:
+        unit = make_unit(channels, groups, kwargs)
+        for height, width in SIZES:
+            x = torch.randn(2, channels, height, width)
+            with torch.no_grad():
+                error = (unit(x) - run_reference(unit, x)).abs().max().item()
+            status = 'ok' if error <= atol else 'MISMATCH'
+            ok = ok and error <= atol
+            print(f'FourierUnit c={channels} groups={groups} {kwargs} {height}x{width}: max abs error {error:.2e} {status}')
+    return ok
+
+
+def check_generator(checkpoint, size, device, repeats, atol):
+    from generator import build_generator
+
+    generator, concat_mask = build_generator(checkpoint)
+    generator.eval().to(device)
+    x = torch.rand(1, 4 if concat_mask else 3, size, size, device=device)
+
+    with torch.no_grad():
+        error = (generator(x) - run_reference(generator, x)).abs().max().item()
+        fast_ms = timed(lambda: generator(x), repeats)
+        reference_ms = timed(lambda: run_reference(generator, x), repeats)
+    print(f'Generator {size}x{size} on {device}: max abs error {error:.2e}, '
+          f'reference {reference_ms:.0f} ms, fast {fast_ms:.0f} ms')
+
+    if device.type == 'cuda':
+        for name, fn in (('reference', lambda: run_reference(generator, x)), ('fast', lambda: generator(x))):
+            torch.cuda.reset_peak_memory_stats(device)
+            with torch.no_grad():
+                fn()
+            print(f'Peak memory ({name}): {torch.cuda.max_memory_allocated(device) / 2 ** 20:.0f} MiB')
+    return error <= atol
+
+
+def main():
+    parser = ArgumentParser(description='Check FourierUnit.forward_inference against the reference FourierUnit path.')
+    parser.add_argument('--checkpoint', default=None, help='Checkpoint dir, also compares the whole generator')
+    parser.add_argument('--size', type=int, default=512, help='Input side for the generator comparison')
+    parser.add_argument('--device', default='cpu', help='Device used for the generator comparison')
+    parser.add_argument('--repeats', type=int, default=5, help='Timed runs per path')
+    parser.add_argument('--atol', type=float, default=1e-4, help='Max allowed absolute difference')
+    args = parser.parse_args()
+
+    torch.manual_seed(0)
+    ok = check_units(args.atol)
+    if args.checkpoint:
+        ok = check_generator(args.checkpoint, args.size, torch.device(args.device), args.repeats, args.atol) and ok
+
+    print('all ok' if ok else 'outputs differ')
+    sys.exit(0 if ok else 1)
+
+
+if __name__ == '__main__':
+    main()
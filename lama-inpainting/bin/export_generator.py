@@ -0,0 +1,26 @@
+from argparse import ArgumentParser
+import time
+
+from generator import export_generator, load_inpaint_model
+
+
+def main():
+    parser = ArgumentParser(description='Export the LaMa generator as a standalone TorchScript artifact.')
+    parser.add_argument('--checkpoint', required=True, help='Checkpoint dir')
+    parser.add_argument('--output', default=None, help='Output path, defaults to <checkpoint>/models/generator.ts')
+    parser.add_argument('--size', type=int, default=256, help='Side of the example input used for tracing')
+    args = parser.parse_args()
+
+    output_path = export_generator(args.checkpoint, args.output, size=args.size)
+    print(f'Saved exported generator: {output_path}')
+
+    if args.output is None:
+        for use_exported in (False, True):
+            start = time.perf_counter()
+            load_inpaint_model(args.checkpoint, use_exported=use_exported)
+            name = 'exported' if use_exported else 'checkpoint'
+            print(f'Load time ({name}): {(time.perf_counter() - start) * 1000:.0f} ms')
+
+
+if __name__ == '__main__':
+    main()
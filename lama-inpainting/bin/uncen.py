@@ -1,57 +1,229 @@
 from argparse import ArgumentParser
+import hashlib
 import os
-import sys
-import traceback
-
-from saicinpainting.evaluation.utils import move_to_device
-from saicinpainting.evaluation.data import ceil_modulo
-os.environ['OMP_NUM_THREADS'] = '1'
-os.environ['OPENBLAS_NUM_THREADS'] = '1'
-os.environ['MKL_NUM_THREADS'] = '1'
-os.environ['VECLIB_MAXIMUM_THREADS'] = '1'
-os.environ['NUMEXPR_NUM_THREADS'] = '1'
+import time
 
 import cv2
-import hydra
 import numpy as np
 import torch
-import tqdm
-import yaml
-from omegaconf import OmegaConf
-from torch.utils.data._utils.collate import default_collate
-
-from saicinpainting.training.data.datasets import make_default_val_dataset
-from saicinpainting.training.data.datasets import make_default_train_dataloader
-from saicinpainting.training.trainers import load_checkpoint
-from saicinpainting.utils import register_debug_signal_handlers
-
-
-from utils import find_regions
-import torch.nn.functional as F
 
-from saicinpainting.training.data.masks import get_mask_generator
+from generator import load_inpaint_model
+from utils import ceil_modulo, find_regions_labeled
 
+# LaMa's prediction refiner settings plus early stopping once the loss stops improving by 0.1%
+REFINE_DEFAULTS = dict(modulo=8, n_iters=15, lr=0.002, min_side=512, max_scales=3, px_budget=1800000,
+                       patience=3, min_delta=1e-3)
 
 
-def init_inpaint_model(model_path):
+def init_inpaint_model(model_path, use_exported=True):
+    """Load the inpainting model for inference, see generator.load_inpaint_model."""
+    return load_inpaint_model(model_path, map_location='cpu', use_exported=use_exported)
 
-    train_config_path = os.path.join(model_path, 'config.yaml')
-    with open(train_config_path, 'r') as f:
-        train_config = OmegaConf.create(yaml.safe_load(f))
 
-    train_config.training_model.predict_only = True
-    train_config.visualizer.kind = 'noop'
-
-    checkpoint_path = os.path.join(model_path, 
-                                   'models', 
-                                   'best.ckpt')
-    model = load_checkpoint(train_config, checkpoint_path, strict=False, map_location='cpu')
-    model.freeze()
-
-    return model
+def find_mask_regions(mask_orig, f=4):
+    """Bounding boxes (min_y, min_x, max_y, max_x) of the mask regions worth inpainting, largest first."""
+    ker = np.ones((0,0), dtype=np.uint8)
+    mask_orig2 = cv2.resize(255-mask_orig, (mask_orig.shape[1]//f, mask_orig.shape[0]//f), cv2.INTER_AREA)
+    its = 36//f
+    mask_orig2 = cv2.erode(mask_orig2, kernel=ker, iterations=its)
+    _, regions = find_regions_labeled(mask_orig2 == 0)
 
+    boxes = []
+    for region in regions:
+        min_x, min_y = region.min_x * f, region.min_y * f
+        max_x, max_y = region.max_x * f, region.max_y * f
+        r_h, r_w = max_y - min_y, max_x - min_x
 
-def inpaint(model, image_orig, mask_orig):
+        pix_cnt = (mask_orig[min_y:max_y, min_x:max_x, 0]/255).sum()
+        if r_h < 10 and r_w < 10 or pix_cnt < 100:
+            continue
+        boxes.append((min_y, min_x, max_y, max_x))
+    return boxes
+
+
+def reflect_indices(start, stop, size):
+    """Indices start..stop-1 mirrored into [0, size) the way 'reflect' padding does (edge not repeated)."""
+    idx = np.arange(start, stop)
+    if size == 1:
+        return np.zeros_like(idx)
+    period = 2 * (size - 1)
+    idx = np.mod(idx, period)
+    return np.where(idx >= size, period - idx, idx)
+
+
+def reflect_crop(array, rsy, rey, rsx, rex):
+    """
+    Window [rsy:rey, rsx:rex] of an HxWxC array, reflect-padded where it leaves the array.
+
+    Same values as reflect-padding the whole array and slicing, but only the
+    window is materialized.
+    """
+    h, w = array.shape[:2]
+    if rsy >= 0 and rsx >= 0 and rey <= h and rex <= w:
+        return array[rsy:rey, rsx:rex]
+    return array[np.ix_(reflect_indices(rsy, rey, h), reflect_indices(rsx, rex, w))]
+
+
+def is_smooth(n, primes=(2, 3, 5)):
+    """True if n has no prime factors other than primes."""
+    for p in primes:
+        while n % p == 0:
+            n //= p
+    return n == 1
+
+
+def fft_size(size, multiple=8):
+    """
+    Smallest multiple of multiple that is >= size and whose quotient only has the factors 2, 3 and 5.
+
+    The generator downsamples crops by 8 before its Fourier units, so with the
+    default multiple every FFT in the resnet blocks runs on a 5-smooth length.
+    """
+    n = ceil_modulo(size, multiple) // multiple
+    while not is_smooth(n):
+        n += 1
+    return n * multiple
+
+
+def bucket_sizes(buckets, fft_friendly=False):
+    """Sorted crop sizes of the configured shape buckets, rounded the way make_batches pads crops."""
+    pad = fft_size if fft_friendly else (lambda size: ceil_modulo(size, 8))
+    return sorted({pad(size) for size in buckets})
+
+
+def make_batches(sizes, batch_size=1, bucket_step=64, fft_friendly=False, buckets=None):
+    """
+    Group crop indices into batches whose crops are padded to one common size.
+
+    Returns a list of (padded_size, indices). With batch_size 1 every crop runs
+    alone at its own size, otherwise sizes are rounded up to bucket_step. With
+    fft_friendly the padded sizes are further rounded up with fft_size. With
+    buckets, crops are snapped to the smallest bucket that fits them instead,
+    so only shapes seen by warmup reach the generator; crops larger than every
+    bucket keep the rounding above.
+    """
+    pad = fft_size if fft_friendly else (lambda size: size)
+    bucket_step = ceil_modulo(bucket_step, 8)
+    snapped = bucket_sizes(buckets, fft_friendly) if buckets else []
+
+    def padded(size):
+        for bucket in snapped:
+            if bucket >= size:
+                return bucket
+        return pad(size if batch_size <= 1 else ceil_modulo(size, bucket_step))
+
+    if batch_size <= 1:
+        return [(padded(size), [i]) for i, size in enumerate(sizes)]
+
+    buckets = {}
+    for i, size in enumerate(sizes):
+        buckets.setdefault(padded(size), []).append(i)
+
+    batches = []
+    for padded_size, indices in sorted(buckets.items()):
+        for start in range(0, len(indices), batch_size):
+            batches.append((padded_size, indices[start:start + batch_size]))
+    return batches
+
+
+def predict_crops(model, crops, padded_size):
+    """Run the generator once over (image, mask) crops padded to padded_size, returns HxWx3 results."""
+    images, masks = [], []
+    for region, region_mask in crops:
+        pad_h, pad_w = padded_size - region.shape[1], padded_size - region.shape[2]
+        images.append(np.pad(region, ((0, 0), (0, pad_h), (0, pad_w)), mode='symmetric'))
+        masks.append(np.pad(region_mask, ((0, 0), (0, pad_h), (0, pad_w)), mode='symmetric'))
+    batch = dict(image=torch.from_numpy(np.stack(images)), mask=torch.from_numpy(np.stack(masks)))
+
+    with torch.no_grad():
+        batch = {name: value.to(model.device) for name, value in batch.items()}
+        batch['mask'] = (batch['mask'] > 0) * 1
+        batch = model(batch)
+        key = 'inpainted'
+        res = batch[key].permute(0, 2, 3, 1).detach().cpu().numpy()
+
+    return [res[i, :region.shape[1], :region.shape[2]] for i, (region, _) in enumerate(crops)]
+
+
+def working_size(size, max_size=None):
+    """Side at which the generator runs a size x size crop: size itself, or max_size (rounded up to 8) if smaller."""
+    if not max_size or size <= max_size:
+        return size
+    return ceil_modulo(max_size, 8)
+
+
+def upscale_result(res, region, region_mask, detail_strength=0.0):
+    """
+    Bring a crop inpainted at reduced resolution back to the full-resolution crop.
+
+    Pixels outside the mask are restored from the full-resolution region. With
+    detail_strength > 0 the high frequencies of the original region, lost by
+    the downscale, are added back inside the mask; useful when the censoring
+    is translucent and the original texture still shows through.
+    """
+    size = region.shape[0]
+    factor = size / res.shape[0]
+    upscaled = cv2.resize(res, (size, size), interpolation=cv2.INTER_CUBIC)
+    region = region.astype('float32') / 255
+    masked = region_mask > 0
+
+    result = np.where(masked, upscaled, region)
+    if detail_strength:
+        detail = region - cv2.GaussianBlur(region, (0, 0), sigmaX=factor / 2)
+        result = result + masked * detail * detail_strength
+    return np.clip(result, 0, 1)
+
+
+def refine_crop(model, region, region_mask, deadline=None, **refine_kwargs):
+    """
+    Inpaint one (image, mask) crop with LaMa's multi-scale refinement, returns an HxWx3 result.
+
+    Needs the eager generator. refine_kwargs override REFINE_DEFAULTS, and
+    deadline (a time.perf_counter() value) cuts the optimization short.
+    """
+    from saicinpainting.evaluation.refinement import refine_predict
+
+    _, h, w = region.shape
+    batch = dict(image=torch.from_numpy(region)[None], mask=(torch.from_numpy(region_mask)[None] > 0).float(),
+                 unpad_to_size=(torch.tensor([h]), torch.tensor([w])))
+    res = refine_predict(batch, model, gpu_ids=None, devices=[model.device], deadline=deadline,
+                         **dict(REFINE_DEFAULTS, **refine_kwargs))
+    return res[0].permute(1, 2, 0).numpy()
+
+
+def warmup(model, buckets, batch_size=1, fft_friendly=False):
+    """
+    Run the generator once per shape bucket and every batch size up to batch_size.
+
+    Allocator growth and, on CUDA, cuDNN autotuning then happen here rather
+    than on the first images that hit each shape. cuDNN autotuning is only
+    enabled with buckets, otherwise every new crop size would be autotuned on
+    first use. Returns the warmed sizes.
+    """
+    sizes = bucket_sizes(buckets, fft_friendly) if buckets else []
+    if sizes and model.device.type == 'cuda':
+        torch.backends.cudnn.benchmark = True
+
+    for size in sizes:
+        crop = (np.zeros((3, size, size), dtype='float32'), np.zeros((1, size, size), dtype='float32'))
+        # The last batch of an image can hold any number of crops
+        for count in range(1, max(1, batch_size) + 1):
+            predict_crops(model, [crop] * count, size)
+    return sizes
+
+
+def inpaint(model, image_orig, mask_orig, batch_size=1, bucket_step=64, fft_friendly=False, buckets=None,
+            max_crop_size=None, detail_strength=0.0, refine=False, refine_min_size=768, refine_time_budget=None,
+            refine_options=None, stats=None, region_results=None):
+    """
+    Inpaint the regions of mask_orig in image_orig, returns (output, debug_image).
+
+    region_results is an optional dict of finished crop results from an earlier
+    call on the same image with the same options. Crops whose window and mask
+    are unchanged are taken from it instead of running the generator again, so
+    after a mask edit only the regions touched by the edit are inpainted. The
+    dict is updated in place to hold the crops of this call.
+    """
 
     ker = np.ones((0,0), dtype=np.uint8)
     mask_orig = cv2.dilate(mask_orig[..., 0], kernel=ker, iterations=1)[..., None]
@@ -68,35 +240,16 @@ def inpaint(model, image_orig, mask_orig):
         image_p = image_p.astype('float32') / 255
         return image_p
 
-    image = proc(image_orig)
-    mask  = proc(mask_orig)
-
-    f = 4
-    ker = np.ones((0,0), dtype=np.uint8)
-    mask_orig2 = cv2.resize(255-mask_orig, (mask_orig.shape[1]//f, mask_orig.shape[0]//f), cv2.INTER_AREA)
-    its = 36//f
-    mask_orig2 = cv2.erode(mask_orig2, kernel=ker, iterations=its)
-    regions = find_regions(np.dstack([mask_orig2, mask_orig2, mask_orig2]), (0, 0, 0)) 
-    for i in range(len(regions)):
-        regions[i] = np.array(list(regions[i])) * f
+    region_find_start = time.perf_counter()
+    boxes = find_mask_regions(mask_orig)
+    if stats is not None:
+        stats['regions'] = len(boxes)
+        stats['region_find_ms'] = (time.perf_counter() - region_find_start) * 1000
 
-
-    out = image_orig.copy()
-    out_orig = image_orig.copy()
-    for pixel_set in regions:
-        s = np.array(list(pixel_set))
-        min_x = np.min(s[:, 1])
-        min_y = np.min(s[:, 0])
-        max_x = np.max(s[:, 1])
-        max_y = np.max(s[:, 0])
+    windows = []
+    for min_y, min_x, max_y, max_x in boxes:
         c_y, c_x = (max_y + min_y)//2, (max_x + min_x)//2
         r_h, r_w = max_y - min_y, max_x - min_x
-        
-        pix_cnt = (mask_orig[min_y:max_y, min_x:max_x, 0]/255).sum() 
-        density = pix_cnt / (r_h * r_w)
-        #print('HERE', pix_cnt, density)
-        if r_h < 10 and r_w < 10 or pix_cnt < 100:
-            continue
 
         const_pp = False
         if const_pp:
@@ -105,34 +258,75 @@ def inpaint(model, image_orig, mask_orig):
             fac = 0.6
             pp = int(round(max(r_h, r_w)*fac))
             pp = ceil_modulo(pp, 8)
-        #print(len(regions), pp)
-        rsy, rey, rsx, rex = c_y-pp, c_y+pp, c_x-pp, c_x+pp
-        #h, w = rey - rsy, rex - rsx
-        pad = pp + 1
-
-        region = F.pad(torch.from_numpy(image).unsqueeze(0), (pad,pad,pad,pad), mode='reflect')[:, :, pad+rsy:pad+rey, pad+rsx:pad+rex].numpy()[0]
-
-
-        region_mask = F.pad(torch.from_numpy(mask).unsqueeze(0), (pad,pad,pad,pad), mode='reflect')[:, :, pad+rsy:pad+rey, pad+rsx:pad+rex].numpy()[0]
-
-        batch_o = [dict(
-                image=region,
-                mask=region_mask,
-                unpad_to_size=(pp*2,pp*2),
-        )]
-        batch = default_collate(batch_o)
-
-        with torch.no_grad():
-            batch = move_to_device(batch, model.device)
-            batch['mask'] = (batch['mask'] > 0) * 1
-            batch = model(batch)                    
-            key = 'inpainted'
-            cur_res = batch[key][0].permute(1, 2, 0).detach().cpu().numpy()
-            unpad_to_size = batch.get('unpad_to_size', None)
-            if unpad_to_size is not None:
-                orig_height, orig_width = unpad_to_size
-                cur_res = cur_res[:orig_height, :orig_width]
+        windows.append((pp, c_y-pp, c_y+pp, c_x-pp, c_x+pp))
+
+    # Crops larger than max_crop_size are inpainted at reduced resolution
+    work_sizes = [working_size(pp*2, max_crop_size) for pp, *_ in windows]
+    if stats is not None:
+        stats['downscaled_regions'] = sum(work < pp*2 for work, (pp, *_) in zip(work_sizes, windows))
+
+    def crop(i):
+        pp, rsy, rey, rsx, rex = windows[i]
+        region = reflect_crop(image_orig, rsy, rey, rsx, rex)
+        region_mask = reflect_crop(mask_orig, rsy, rey, rsx, rex)
+        if work_sizes[i] < pp*2:
+            region = cv2.resize(region, (work_sizes[i], work_sizes[i]), interpolation=cv2.INTER_AREA)
+            region_mask = cv2.resize(region_mask, (work_sizes[i], work_sizes[i]), interpolation=cv2.INTER_AREA)[..., None]
+        return proc(region), proc(region_mask)
+
+    def finish(i, cur_res):
+        pp, rsy, rey, rsx, rex = windows[i]
+        if cur_res.shape[0] < pp*2:
+            cur_res = upscale_result(cur_res, reflect_crop(image_orig, rsy, rey, rsx, rex),
+                                     reflect_crop(mask_orig, rsy, rey, rsx, rex), detail_strength)
+        return cur_res
+
+    # Crops are taken from the untouched image, so they can run in any order
+    # and batched together; blending below keeps the original region order
+    results = [None] * len(windows)
+
+    # A crop only depends on its window, its working size and the mask inside
+    # it, so edits elsewhere in the mask leave its cached result valid
+    keys = None
+    if region_results is not None:
+        keys = [(window, work_size, hashlib.sha1(reflect_crop(mask_orig, *window[1:]).tobytes()).hexdigest())
+                for window, work_size in zip(windows, work_sizes)]
+        results = [region_results.get(key) for key in keys]
+    if stats is not None:
+        stats['reused_regions'] = sum(cur_res is not None for cur_res in results)
+
+    # Regions with crops of at least refine_min_size are refined one by one,
+    # largest first, until the time budget of the image is spent
+    refined = 0
+    if refine:
+        if not isinstance(getattr(model.generator, 'model', None), torch.nn.Sequential):
+            raise ValueError('Refinement needs the eager generator, load the model with use_exported=False')
+        deadline = time.perf_counter() + refine_time_budget if refine_time_budget else None
+        for i, (pp, *_) in enumerate(windows):
+            if pp*2 < refine_min_size or results[i] is not None:
+                continue
+            if deadline is not None and time.perf_counter() >= deadline:
+                break
+            results[i] = finish(i, refine_crop(model, *crop(i), deadline=deadline, **(refine_options or {})))
+            refined += 1
+    if stats is not None:
+        stats['refined_regions'] = refined
+
+    pending = [i for i, cur_res in enumerate(results) if cur_res is None]
+    for padded_size, batch_indices in make_batches([work_sizes[i] for i in pending], batch_size, bucket_step,
+                                                   fft_friendly, buckets):
+        indices = [pending[j] for j in batch_indices]
+        crops = [crop(i) for i in indices]
+        for i, cur_res in zip(indices, predict_crops(model, crops, padded_size)):
+            results[i] = finish(i, cur_res)
+
+    if region_results is not None:
+        region_results.clear()
+        region_results.update(zip(keys, results))
 
+    out = image_orig.copy()
+    out_orig = image_orig.copy()
+    for (pp, rsy, rey, rsx, rex), cur_res in zip(windows, results):
         cur_mask = mask_blend[max(0,rsy):rey, max(0,rsx):rex, :] / 255
         out[max(0,rsy):rey, max(0,rsx):rex, :] = (cur_res[max(0, -rsy):min(pp*2, pp*2-(rey-out.shape[0])), max(0, -rsx):min(pp*2, pp*2-(rex-out.shape[1])), :] * 255) * cur_mask    +   out[max(0,rsy):rey, max(0,rsx):rex, :] * (1-cur_mask) 
         cv2.rectangle(out_orig, (max(0,rsx),max(0,rsy)), (rex,rey), color=(0,0,255), thickness=2)
@@ -145,7 +339,7 @@ def inpaint(model, image_orig, mask_orig):
     return out, out_dbg
 
 
-def process_directory_recursively(input_dir, mask_dir, output_dir, debug_dir, model):
+def process_directory_recursively(input_dir, mask_dir, output_dir, debug_dir, model, **inpaint_kwargs):
     workspace_root = os.environ.get('WORKSPACE_ROOT', '')
     
     for root, _, files in os.walk(input_dir):
@@ -157,28 +351,28 @@ def process_directory_recursively(input_dir, mask_dir, output_dir, debug_dir, mo
         if debug_subdir:
             os.makedirs(debug_subdir, exist_ok=True)
 
+        # List the matching mask directory once instead of probing extensions per image
+        mask_subdir = os.path.join(mask_dir, relative_path)
+        mask_files = set(os.listdir(mask_subdir)) if os.path.isdir(mask_subdir) else set()
+        masks_by_name = {}
+        for mask_name in sorted(mask_files):
+            base_name, ext = os.path.splitext(mask_name)
+            if ext.lower() in ('.png', '.jpg', '.jpeg', '.webp'):
+                masks_by_name.setdefault(base_name, mask_name)
+
         for file in files:
             # Support both original and PNG extensions
             if file.lower().endswith('.png'):
                 in_file = os.path.join(root, file)
-                mask_file = os.path.join(mask_dir, relative_path, file)
+                mask_file = os.path.join(mask_subdir, file)
 
-                if not os.path.exists(mask_file):
-                    print(f"Mask file not found for {file}, checking for mask with different extension...")
+                if file not in mask_files:
                     base_name = os.path.splitext(file)[0]
-                    mask_found = False
-                    
-                    for ext in ['.png', '.jpg', '.jpeg', '.webp']:
-                        potential_mask = os.path.join(mask_dir, relative_path, base_name + ext)
-                        if os.path.exists(potential_mask):
-                            mask_file = potential_mask
-                            mask_found = True
-                            print(f"Found matching mask: {os.path.basename(mask_file)}")
-                            break
-                            
-                    if not mask_found:
+                    if base_name not in masks_by_name:
                         print(f"No mask file found for {file}, skipping.")
                         continue
+                    mask_file = os.path.join(mask_subdir, masks_by_name[base_name])
+                    print(f"Found matching mask: {os.path.basename(mask_file)}")
 
                 display_path = in_file
                 if workspace_root and in_file.startswith(workspace_root):
@@ -198,7 +392,7 @@ def process_directory_recursively(input_dir, mask_dir, output_dir, debug_dir, mo
                         print(f"Error: Could not read mask file {os.path.basename(mask_file)}")
                         continue
 
-                    output, dbg = inpaint(model, img, mask)
+                    output, dbg = inpaint(model, img, mask, **inpaint_kwargs)
 
                     out_path = os.path.join(output_subdir, file)
                     cv2.imwrite(out_path, cv2.cvtColor(output, cv2.COLOR_BGR2RGB))
@@ -219,9 +413,35 @@ def main():
     parser.add_argument('--checkpoint', required=True, help='Checkpoint dir')
     parser.add_argument('--device', default='cuda:0', help='Device used for inference')
     parser.add_argument('--debug_dir', default=None, help='dir with debug output')
+    parser.add_argument('--batch_size', type=int, default=1, help='Max regions inpainted in one forward pass')
+    parser.add_argument('--bucket_step', type=int, default=64,
+                        help='Crop sizes are padded up to a multiple of this to share a batch (rounded to 8)')
+    parser.add_argument('--fft_friendly', action='store_true',
+                        help='Pad crops up to sizes whose FFTs are fast (8 x products of 2, 3 and 5)')
+    parser.add_argument('--buckets', type=int, nargs='*', default=None,
+                        help='Crop sizes crops are snapped up to, e.g. 256 384 512 768 1024')
+    parser.add_argument('--max_crop_size', type=int, default=None,
+                        help='Crops larger than this are inpainted at this size and upscaled back')
+    parser.add_argument('--detail_strength', type=float, default=0.0,
+                        help='Weight of the original high frequencies added back to upscaled crops inside the mask')
+    parser.add_argument('--refine', action='store_true',
+                        help='Refine large regions with multi-scale optimization (slower, sharper)')
+    parser.add_argument('--refine_min_size', type=int, default=768, help='Min crop size of refined regions')
+    parser.add_argument('--refine_time_budget', type=float, default=None,
+                        help='Seconds of refinement per image, remaining regions are inpainted normally')
+    parser.add_argument('--refine_iters', type=int, default=REFINE_DEFAULTS['n_iters'],
+                        help='Max optimization iterations per refinement scale')
+    parser.add_argument('--threads', type=int, default=0,
+                        help='CPU threads used by torch and OpenCV, 0 keeps their defaults (all cores)')
+    parser.add_argument('--eager', action='store_true',
+                        help='Build the generator from best.ckpt even if an exported one exists')
     args = parser.parse_args()
 
-    model = init_inpaint_model(args.checkpoint)
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+        cv2.setNumThreads(args.threads)
+
+    model = init_inpaint_model(args.checkpoint, use_exported=not args.eager and not args.refine)
     device = torch.device(args.device)
     model.to(device)
 
@@ -230,7 +450,13 @@ def main():
     if args.debug_dir and not os.path.exists(args.debug_dir):
         os.makedirs(args.debug_dir)
 
-    process_directory_recursively(args.in_dir, args.mask_dir, args.out_dir, args.debug_dir, model)
+    process_directory_recursively(args.in_dir, args.mask_dir, args.out_dir, args.debug_dir, model,
+                                  batch_size=args.batch_size, bucket_step=args.bucket_step,
+                                  fft_friendly=args.fft_friendly, buckets=args.buckets,
+                                  max_crop_size=args.max_crop_size, detail_strength=args.detail_strength,
+                                  refine=args.refine, refine_min_size=args.refine_min_size,
+                                  refine_time_budget=args.refine_time_budget,
+                                  refine_options={'n_iters': args.refine_iters})
 
 
 if __name__ == '__main__':
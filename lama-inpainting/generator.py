@@ -0,0 +1,125 @@
+import json
+import os
+
+import torch
+import torch.nn as nn
+from omegaconf import OmegaConf
+
+# Only the generator is needed for inference, so this module imports neither
+# pytorch_lightning, hydra nor the evaluation stack pulled in by load_checkpoint
+CHECKPOINT_FILENAME = 'best.ckpt'
+EXPORTED_FILENAME = 'generator.ts'
+EXPORT_METADATA = 'camelia.json'
+
+
+class InpaintingModel(nn.Module):
+    """
+    Inference-only stand-in for DefaultInpaintingTrainingModule.
+
+    Takes the same {'image', 'mask'} batches and fills in 'predicted_image'
+    and 'inpainted' the same way, around either the eager FFCResNetGenerator
+    or its exported TorchScript graph.
+    """
+
+    def __init__(self, generator, concat_mask=True):
+        super().__init__()
+        self.generator = generator
+        self.concat_mask = concat_mask
+
+    @property
+    def device(self):
+        return next(self.generator.parameters()).device
+
+    def forward(self, batch):
+        img = batch['image']
+        mask = batch['mask']
+
+        masked_img = img * (1 - mask)
+        if self.concat_mask:
+            masked_img = torch.cat([masked_img, mask], dim=1)
+
+        batch['predicted_image'] = self.generator(masked_img)
+        batch['inpainted'] = mask * batch['predicted_image'] + (1 - mask) * batch['image']
+        return batch
+
+
+def read_config(model_path):
+    """Generator kwargs and concat_mask from the training config.yaml of a checkpoint directory."""
+    # Resolved like the training code does, so ${...} interpolations reach the generator as values
+    config = OmegaConf.to_container(OmegaConf.load(os.path.join(model_path, 'config.yaml')), resolve=True)
+
+    generator_kwargs = dict(config['generator'])
+    kind = generator_kwargs.pop('kind')
+    if kind != 'ffc_resnet':
+        raise ValueError(f'Unsupported generator kind {kind}')
+
+    training_model = config.get('training_model', {})
+    if training_model.get('add_noise_kwargs') is not None:
+        raise ValueError('Generators trained with add_noise_kwargs are not supported')
+    return generator_kwargs, training_model.get('concat_mask', True)
+
+
+def build_generator(model_path, map_location='cpu'):
+    """Build the eager FFCResNetGenerator and load its weights from the Lightning checkpoint."""
+    from saicinpainting.training.modules.ffc import FFCResNetGenerator
+
+    generator_kwargs, concat_mask = read_config(model_path)
+    generator = FFCResNetGenerator(**generator_kwargs)
+
+    state = torch.load(os.path.join(model_path, 'models', CHECKPOINT_FILENAME), map_location=map_location)
+    prefix = 'generator.'
+    generator.load_state_dict({name[len(prefix):]: value for name, value in state['state_dict'].items()
+                               if name.startswith(prefix)})
+    return generator, concat_mask
+
+
+def exported_path(model_path):
+    return os.path.join(model_path, 'models', EXPORTED_FILENAME)
+
+
+def export_generator(model_path, output_path=None, size=256, atol=1e-4):
+    """
+    Trace the generator with TorchScript and save it as a standalone artifact.
+
+    The graph is traced at size x size and checked against the eager generator
+    at a different, non-square size, so a graph that baked in the example shape
+    is never saved. Returns the path of the artifact.
+    """
+    generator, concat_mask = build_generator(model_path)
+    generator.eval()
+    channels = 4 if concat_mask else 3
+
+    with torch.no_grad():
+        traced = torch.jit.trace(generator, torch.rand(1, channels, size, size), check_trace=False)
+        check = torch.rand(1, channels, size + 64, size + 136)
+        error = (traced(check) - generator(check)).abs().max().item()
+    if error > atol:
+        raise RuntimeError(f'Traced generator differs from the eager one by {error:.2e} at another input size')
+
+    output_path = output_path or exported_path(model_path)
+    metadata = {'concat_mask': concat_mask}
+    traced.save(output_path, _extra_files={EXPORT_METADATA: json.dumps(metadata)})
+    return output_path
+
+
+def load_inpaint_model(model_path, map_location='cpu', use_exported=True):
+    """
+    Load the inpainting model of a checkpoint directory for inference.
+
+    Uses the exported generator (models/generator.ts) when there is one that
+    is not older than best.ckpt, which also skips unpickling the checkpoint.
+    Otherwise builds the eager generator from config.yaml and best.ckpt.
+    """
+    artifact = exported_path(model_path)
+    checkpoint = os.path.join(model_path, 'models', CHECKPOINT_FILENAME)
+    if use_exported and os.path.exists(artifact):
+        if os.path.exists(checkpoint) and os.path.getmtime(checkpoint) > os.path.getmtime(artifact):
+            print(f'Ignoring {EXPORTED_FILENAME}, it is older than {CHECKPOINT_FILENAME}')
+        else:
+            extra_files = {EXPORT_METADATA: ''}
+            generator = torch.jit.load(artifact, map_location=map_location, _extra_files=extra_files)
+            model = InpaintingModel(generator, json.loads(extra_files[EXPORT_METADATA])['concat_mask'])
+            return model.eval().requires_grad_(False)
+
+    model = InpaintingModel(*build_generator(model_path, map_location=map_location))
+    return model.eval().requires_grad_(False)
@@ -2,11 +2,13 @@ import logging
 
 import torch
 
-from saicinpainting.evaluation.evaluator import InpaintingEvaluatorOnline, ssim_fid100_f1, lpips_fid100_f1
-from saicinpainting.evaluation.losses.base_loss import SSIMScore, LPIPSScore, FIDScore
-
 
 def make_evaluator(kind='default', ssim=True, lpips=True, fid=True, integral_kind=None, **kwargs):
+    # imported here so that inference-only modules of this package (data, refinement)
+    # do not load the metric networks
+    from saicinpainting.evaluation.evaluator import InpaintingEvaluatorOnline, ssim_fid100_f1, lpips_fid100_f1
+    from saicinpainting.evaluation.losses.base_loss import SSIMScore, LPIPSScore, FIDScore
+
     logging.info(f'Make evaluator {kind}')
     device = "cuda" if torch.cuda.is_available() else "cpu"
     metrics = {}
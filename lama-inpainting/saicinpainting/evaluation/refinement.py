@@ -1,3 +1,5 @@
+import time
+
 import torch
 import torch.nn as nn
 from torch.optim import Adam, SGD 
@@ -87,7 +89,8 @@ def _infer(
     image : torch.Tensor, mask : torch.Tensor, 
     forward_front : nn.Module, forward_rears : nn.Module, 
     ref_lower_res : torch.Tensor, orig_shape : tuple, devices : list, 
-    scale_ind : int, n_iters : int=15, lr : float=0.002):
+    scale_ind : int, n_iters : int=15, lr : float=0.002,
+    deadline : float=None, patience : int=None, min_delta : float=0.0):
     """Performs inference with refinement at a given scale.
 
     Parameters
@@ -112,6 +115,12 @@ def _infer(
         number of iterations of refinement, by default 15
     lr : float, optional
         learning rate, by default 0.002
+    deadline : float, optional
+        time.perf_counter() value after which no more iterations are run, by default None
+    patience : int, optional
+        stop after this many iterations without a relative loss improvement of min_delta, by default None
+    min_delta : float, optional
+        relative loss improvement that resets the patience counter, by default 0.0
 
     Returns
     -------
@@ -136,6 +145,7 @@ def _infer(
 
     optimizer = Adam([z1,z2], lr=lr)
 
+    best_loss, stale_iters = None, 0
     pbar = tqdm(range(n_iters), leave=False)
     for idi in pbar:
         optimizer.zero_grad()
@@ -161,7 +171,16 @@ def _infer(
         losses["ms_l1"] = _l1_loss(pred, pred_downscaled, ref_lower_res, mask, mask_downscaled, image, on_pred=True)
 
         loss = sum(losses.values())
-        pbar.set_description("Refining scale {} using scale {} ...current loss: {:.4f}".format(scale_ind+1, scale_ind, loss.item()))
+        loss_value = loss.item()
+        pbar.set_description("Refining scale {} using scale {} ...current loss: {:.4f}".format(scale_ind+1, scale_ind, loss_value))
+
+        # stop once the loss plateaus or the time budget is spent, keeping the current prediction
+        if best_loss is None or loss_value < best_loss * (1 - min_delta):
+            best_loss, stale_iters = loss_value, 0
+        else:
+            stale_iters += 1
+        if (patience is not None and stale_iters >= patience) or (deadline is not None and time.perf_counter() >= deadline):
+            break
         if idi < n_iters - 1:
             loss.backward()
             optimizer.step()
@@ -228,7 +247,8 @@ def _get_image_mask_pyramid(batch : dict, min_side : int, max_scales : int, px_b
 def refine_predict(
     batch : dict, inpainter : nn.Module, gpu_ids : str, 
     modulo : int, n_iters : int, lr : float, min_side : int, 
-    max_scales : int, px_budget : int
+    max_scales : int, px_budget : int, devices : list=None,
+    deadline : float=None, patience : int=None, min_delta : float=0.0
     ):
     """Refines the inpainting of the network
 
@@ -239,7 +259,7 @@ def refine_predict(
     inpainter : nn.Module
         the inpainting neural network
     gpu_ids : str
-        the GPU ids of the machine to use. If only single GPU, use: "0,"
+        the GPU ids of the machine to use. If only single GPU, use: "0,". Runs on the CPU if there are none
     modulo : int
         pad the image to ensure dimension % modulo == 0
     n_iters : int
@@ -252,6 +272,14 @@ def refine_predict(
         max number of downscaling scales for the image-mask pyramid
     px_budget : int
         pixels budget. Any image will be resized to satisfy height*width <= px_budget
+    devices : list, optional
+        devices to split the network across, overrides gpu_ids, by default None
+    deadline : float, optional
+        time.perf_counter() value after which each remaining scale runs a single forward pass, by default None
+    patience : int, optional
+        per-scale early stopping, see _infer, by default None
+    min_delta : float, optional
+        per-scale early stopping, see _infer, by default 0.0
 
     Returns
     -------
@@ -260,10 +288,15 @@ def refine_predict(
     """
 
     assert not inpainter.training
-    assert not inpainter.add_noise_kwargs
+    assert not getattr(inpainter, 'add_noise_kwargs', None)
     assert inpainter.concat_mask
 
-    gpu_ids = [f'cuda:{gpuid}' for gpuid in gpu_ids.replace(" ","").split(",") if gpuid.isdigit()]
+    if devices is None:
+        gpu_ids = [f'cuda:{gpuid}' for gpuid in (gpu_ids or "").replace(" ","").split(",") if gpuid.isdigit()]
+        devices = [torch.device(gpu_id) for gpu_id in gpu_ids] or [torch.device('cpu')]
+    gpu_ids = [str(device) for device in devices]
+    # only the front features are optimized, so skip the weight gradients
+    inpainter.generator.requires_grad_(False)
     n_resnet_blocks = 0
     first_resblock_ind = 0
     found_first_resblock = False
@@ -275,8 +308,6 @@ def refine_predict(
             first_resblock_ind += 1
     resblocks_per_gpu = n_resnet_blocks // len(gpu_ids)
 
-    devices = [torch.device(gpu_id) for gpu_id in gpu_ids]
-    
     # split the model into front, and rear parts    
     forward_front = inpainter.generator.model[0:first_resblock_ind]
     forward_front.to(devices[0])
@@ -305,7 +336,8 @@ def refine_predict(
         image, mask = move_to_device(image, devices[0]), move_to_device(mask, devices[0])
         if image_inpainted is not None:
             image_inpainted = move_to_device(image_inpainted, devices[-1])
-        image_inpainted = _infer(image, mask, forward_front, forward_rears, image_inpainted, orig_shape, devices, ids, n_iters, lr)
+        image_inpainted = _infer(image, mask, forward_front, forward_rears, image_inpainted, orig_shape, devices, ids, n_iters, lr,
+                                 deadline=deadline, patience=patience, min_delta=min_delta)
         image_inpainted = image_inpainted[:,:,:orig_shape[0], :orig_shape[1]]
         # detach everything to save resources
         image = image.detach().cpu()
@@ -47,6 +47,8 @@ class FFCSE_block(nn.Module):
 
 
 class FourierUnit(nn.Module):
+    # eval mode uses forward_inference, set to False to always run the reference path
+    use_fast_inference = True
 
     def __init__(self, in_channels, out_channels, groups=1, spatial_scale_factor=None, spatial_scale_mode='bilinear',
                  spectral_pos_encoding=False, use_se=False, se_kwargs=None, ffc3d=False, fft_norm='ortho'):
@@ -74,6 +76,9 @@ class FourierUnit(nn.Module):
         self.fft_norm = fft_norm
 
     def forward(self, x):
+        if self.use_fast_inference and not self.training and not self.ffc3d:
+            return self.forward_inference(x)
+
         batch = x.shape[0]
 
         if self.spatial_scale_factor is not None:
@@ -112,6 +117,57 @@ class FourierUnit(nn.Module):
 
         return output
 
+    def fused_conv_bn(self, x):
+        """conv_layer followed by bn with its running statistics folded into the 1x1 kernel (eval mode only)."""
+        if self.bn.running_var is None:
+            return self.bn(self.conv_layer(x))
+        scale = torch.rsqrt(self.bn.running_var + self.bn.eps)
+        shift = -self.bn.running_mean * scale
+        if self.bn.affine:
+            scale = scale * self.bn.weight
+            shift = shift * self.bn.weight + self.bn.bias
+        weight = self.conv_layer.weight * scale.view(-1, 1, 1, 1)
+        return F.conv2d(x, weight, shift, groups=self.groups)
+
+    def forward_inference(self, x):
+        """
+        Eval-mode forward with the same result as the reference path and fewer copies of the spectrum.
+
+        The spectrum is viewed as real with view_as_real/view_as_complex, so it
+        is copied once into the channel layout of the conv and once back,
+        instead of stack, contiguous, contiguous and complex. BatchNorm is
+        folded into the conv, which saves another pass over the spectrum.
+        """
+        batch = x.shape[0]
+
+        if self.spatial_scale_factor is not None:
+            orig_size = x.shape[-2:]
+            x = F.interpolate(x, scale_factor=self.spatial_scale_factor, mode=self.spatial_scale_mode, align_corners=False)
+
+        # (batch, c, h, w/2+1, 2) view -> (batch, c*2, h, w/2+1), channels ordered (c, re/im) as in forward
+        ffted = torch.fft.rfftn(x, dim=(-2, -1), norm=self.fft_norm)
+        height, width = ffted.shape[-2:]
+        ffted = torch.view_as_real(ffted).permute(0, 1, 4, 2, 3).reshape(batch, -1, height, width)
+
+        if self.spectral_pos_encoding:
+            coords_vert = torch.linspace(0, 1, height)[None, None, :, None].expand(batch, 1, height, width).to(ffted)
+            coords_hor = torch.linspace(0, 1, width)[None, None, None, :].expand(batch, 1, height, width).to(ffted)
+            ffted = torch.cat((coords_vert, coords_hor, ffted), dim=1)
+
+        if self.use_se:
+            ffted = self.se(ffted)
+
+        ffted = self.relu(self.fused_conv_bn(ffted))  # (batch, c*2, h, w/2+1)
+
+        # (batch, c, 2, h, w/2+1) -> (batch, c, h, w/2+1, 2), the one copy view_as_complex needs
+        ffted = ffted.view(batch, -1, 2, height, width).permute(0, 1, 3, 4, 2).contiguous()
+        output = torch.fft.irfftn(torch.view_as_complex(ffted), s=x.shape[-2:], dim=(-2, -1), norm=self.fft_norm)
+
+        if self.spatial_scale_factor is not None:
+            output = F.interpolate(output, size=orig_size, mode=self.spatial_scale_mode, align_corners=False)
+
+        return output
+
 
 class SpectralTransform(nn.Module):
 
@@ -1,7 +1,12 @@
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
-from kornia.geometry.transform import rotate
+
+
+def rotate(*args, **kwargs):
+    # kornia is only needed by generators configured with a spatial transform
+    from kornia.geometry.transform import rotate as kornia_rotate
+    return kornia_rotate(*args, **kwargs)
 
 
 class LearnableSpatialTransformWrapper(nn.Module):
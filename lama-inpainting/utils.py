@@ -1,6 +1,18 @@
+from collections import namedtuple
+
+import cv2
 import numpy as np
 from PIL import Image, ImageDraw
 
+# bounding box coordinates are inclusive, x is the column and y the row
+Region = namedtuple('Region', ['label', 'min_x', 'min_y', 'max_x', 'max_y', 'pix_cnt'])
+
+#round x up to a multiple of mod
+def ceil_modulo(x, mod):
+    if x % mod == 0:
+        return x
+    return (x // mod + 1) * mod
+
 #convert PIL image to numpy array
 def image_to_array(image):
     array = np.asarray(image)
@@ -40,6 +52,19 @@ def find_regions(image, mask_color):
     regions.sort(key = len, reverse = True)
     return regions
 
+#label the connected components of the non-zero pixels of a mask in a single pass
+#same components and ordering as find_regions, without per-pixel python objects
+def find_regions_labeled(mask, connectivity=4):
+    n_labels, labels, stats, _ = cv2.connectedComponentsWithStats(
+        (np.asarray(mask) > 0).astype(np.uint8), connectivity=connectivity)
+    #label 0 is the background; labels follow raster order, so a stable sort keeps find_regions' tie order
+    order = np.argsort(-stats[1:, cv2.CC_STAT_AREA], kind='stable') + 1
+    regions = []
+    for label in order:
+        x, y, w, h, area = stats[label]
+        regions.append(Region(int(label), int(x), int(y), int(x + w - 1), int(y + h - 1), int(area)))
+    return labels, regions
+
 # risk of box being bigger than the image
 def expand_bounding(img, region, expand_factor=1.5, min_size = 256):
     #expand bounding box to capture more context
@@ -1,156 +1,57 @@
 import os
-import subprocess
 import argparse
 import shutil
 
-def get_relative_path(full_path, workspace_root):
-    """Convert a full path to a relative path from workspace root."""
-    if full_path.startswith(workspace_root):
-        return full_path[len(workspace_root):].lstrip(os.sep)
-    return full_path
-
-def run_segmentation(model_type, segmentation_script, input_dir, output_dir, workspace_root):
-    """Run the segmentation step."""
-    print(f"Running segmentation with model type: {model_type}")
-    
-    script_path = os.path.abspath(segmentation_script)
-    script_dir = os.path.dirname(script_path)
-    input_dir_abs = os.path.abspath(input_dir)
-    output_dir_abs = os.path.abspath(output_dir)
-    
-    current_dir = os.getcwd()
-    
-    # Setup environment variables to ensure unbuffered output
-    env = os.environ.copy()
-    env['PYTHONUNBUFFERED'] = '1'
-    env['PYTHONIOENCODING'] = 'UTF-8'
-    env['WORKSPACE_ROOT'] = workspace_root  # Pass workspace root to child processes
-    
-    try:
-        if script_dir:
-            os.chdir(script_dir)
-        
-        script_name = os.path.basename(script_path)
-        command = [
-            "python",
-            "-u",  # Unbuffered mode
-            script_name,
-            "--model_type", model_type,
-            "--input_dir", input_dir_abs,
-            "--output_dir", output_dir_abs
-        ]
-        
-        # Use subprocess.Popen for more control over real-time output
-        process = subprocess.Popen(
-            command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True, 
-            bufsize=1,  # Line buffered
-            universal_newlines=True,
-            env=env
-        )
-        
-        # Process and print output line by line in real-time
-        for line in iter(process.stdout.readline, ''):
-            if line.strip():
-                print(line.strip(), flush=True)
-                
-        process.stdout.close()
-        return_code = process.wait()
-        
-        if return_code != 0:
-            print(f"Segmentation process exited with code {return_code}", flush=True)
-            return False
-            
-    finally:
-        os.chdir(current_dir)
-    
-    print("Segmentation completed", flush=True)
-    return True
-
-def run_inpainting(in_dir, mask_dir, out_dir, checkpoint, inpainting_script, workspace_root, debug_dir=None):
-    """Run the inpainting step."""
-    print("Running inpainting...", flush=True)
-    
-    in_dir_abs = os.path.abspath(in_dir)
-    mask_dir_abs = os.path.abspath(mask_dir)
-    out_dir_abs = os.path.abspath(out_dir)
-    checkpoint_abs = os.path.abspath(checkpoint)
-    
-    script_name = os.path.basename(inpainting_script)
-    
-    lama_root = os.path.dirname(os.path.dirname(os.path.abspath(inpainting_script)))
-    
-    current_dir = os.getcwd()
-    
-    env = os.environ.copy()
-    env["PYTHONPATH"] = lama_root + (os.pathsep + env["PYTHONPATH"] if "PYTHONPATH" in env else "")
-    env['PYTHONUNBUFFERED'] = '1'
-    env['PYTHONIOENCODING'] = 'UTF-8'
-    env['WORKSPACE_ROOT'] = workspace_root
-    
-    print(f"Running from lama root: {get_relative_path(lama_root, workspace_root)}", flush=True)
-    print(f"Using checkpoint: {get_relative_path(checkpoint_abs, workspace_root)}", flush=True)
-    
-    try:
-        os.chdir(lama_root)
-        
-        command = [
-            "python",
-            "-u",
-            os.path.join("bin", script_name),
-            "--in_dir", in_dir_abs,
-            "--mask_dir", mask_dir_abs,
-            "--out_dir", out_dir_abs,
-            "--checkpoint", checkpoint_abs
-        ]
-        
-        if debug_dir:
-            debug_dir_abs = os.path.abspath(debug_dir)
-            command.extend(["--debug_dir", debug_dir_abs])
-        
-        # Use subprocess.Popen for real-time output
-        process = subprocess.Popen(
-            command,
-            stdout=subprocess.PIPE,
-            stderr=subprocess.STDOUT,
-            text=True, 
-            bufsize=1,  # Line buffered
-            universal_newlines=True,
-            env=env
-        )
-        
-        # Process and print output line by line in real-time
-        for line in iter(process.stdout.readline, ''):
-            if line.strip():
-                # Clean path to be relative
-                cleaned_line = line.strip()
-                for path_fragment in [in_dir_abs, mask_dir_abs, out_dir_abs, checkpoint_abs, lama_root]:
-                    if path_fragment in cleaned_line:
-                        rel_path = get_relative_path(path_fragment, workspace_root)
-                        cleaned_line = cleaned_line.replace(path_fragment, rel_path)
-                print(cleaned_line, flush=True)
-                
-        process.stdout.close()
-        return_code = process.wait()
-        
-        if return_code != 0:
-            print(f"Inpainting process exited with code {return_code}", flush=True)
-            return False
-            
-    finally:
-        os.chdir(current_dir)
-    
-    print("Inpainting completed", flush=True)
-    return True
+from pipeline import (
+    CameliaPipeline, DEFAULT_CHECKPOINT, apply_thread_budget, collect_images, get_relative_path, resolve_thread_budget
+)
+from result_cache import ResultCache
+from worker import PipelineWorker
 
 def main():
     parser = argparse.ArgumentParser(description="Pipeline to connect segmentation and inpainting.")
     parser.add_argument("--model_type", required=True, choices=["black_bars", "white_bars", "transparent_black"],
                         help="Model type for segmentation.")
+    parser.add_argument("--save_temp", action="store_true",
+                        help="Also dump the original images and predicted masks as PNGs in the temp directory.")
     parser.add_argument("--clean_temp", action="store_true", 
                         help="Delete temporary files after processing is complete.")
+    parser.add_argument("--device", default=None,
+                        help="Device used for inference. Defaults to CUDA when available.")
+    parser.add_argument("--batch_size", type=int, default=1,
+                        help="Images segmented in one forward pass. Images are decoded one batch ahead on a "
+                             "loader thread.")
+    parser.add_argument("--inpaint_batch_size", type=int, default=1,
+                        help="Max censored regions of an image inpainted in one forward pass.")
+    parser.add_argument("--fft_friendly", action="store_true",
+                        help="Pad inpainting crops up to sizes whose FFTs are fast.")
+    parser.add_argument("--inpaint_buckets", type=int, nargs="*", default=None,
+                        help="Crop sizes inpainting crops are snapped up to, e.g. 256 384 512 768 1024.")
+    parser.add_argument("--inpaint_max_size", type=int, default=None,
+                        help="Inpaint crops larger than this at this size and upscale them back.")
+    parser.add_argument("--detail_strength", type=float, default=0.0,
+                        help="Weight of the original high frequencies added back to upscaled crops.")
+    parser.add_argument("--refine", action="store_true",
+                        help="Refine large regions with LaMa's multi-scale optimization (slower, sharper).")
+    parser.add_argument("--refine_min_size", type=int, default=768,
+                        help="Min crop size in pixels of the regions that are refined.")
+    parser.add_argument("--refine_time_budget", type=float, default=None,
+                        help="Seconds of refinement per image, the remaining regions are inpainted normally.")
+    parser.add_argument("--tiled_segmentation", action="store_true",
+                        help="Segment at native resolution with overlapping tiles instead of resizing to 1024x1024.")
+    parser.add_argument("--threads", type=int, default=0,
+                        help="CPU threads per image. 0 splits the available cores between the image workers.")
+    parser.add_argument("--interop_threads", type=int, default=0,
+                        help="Torch inter-op threads. 0 keeps the torch default.")
+    parser.add_argument("--image_workers", type=int, default=1,
+                        help="Images processed at the same time, sharing the loaded models.")
+    parser.add_argument("--precision", default="fp32", choices=["fp32", "bf16", "fp16"],
+                        help="Segmentation inference precision. bf16 is fastest on recent CPUs, fp16 needs CUDA.")
+    parser.add_argument("--channels_last", action="store_true",
+                        help="Run the segmentation model in channels-last memory format.")
+    parser.add_argument("--cache", action="store_true",
+                        help="Reuse results of images already processed with the same models and options "
+                             "(stored under camelia-decensor/cache).")
     args = parser.parse_args()
     
     workspace_root = os.path.dirname(os.path.abspath(__file__))
@@ -165,32 +66,53 @@ def main():
     print(f"Output directory: {get_relative_path(camelia_output, workspace_root)}")
     print(f"Temp directory: {get_relative_path(camelia_temp, workspace_root)}")
 
-    # Run segmentation
-    segmentation_success = run_segmentation(
-        model_type=args.model_type,
-        segmentation_script=os.path.join(workspace_root, "smp-segmentation", "run_segmentation.py"),
-        input_dir=camelia_input,
-        output_dir=camelia_temp,
-        workspace_root=workspace_root
-    )
-
-    if not segmentation_success:
-        print("Segmentation failed. Exiting pipeline.", flush=True)
+    input_dir = os.path.join(camelia_input, args.model_type)
+    if not os.path.exists(input_dir):
+        os.makedirs(input_dir, exist_ok=True)
+        print(f"Created input directory: {get_relative_path(input_dir, workspace_root)}")
+        print(f"Please place input images in {get_relative_path(input_dir, workspace_root)}")
         return
 
-    # Run inpainting
-    inpainting_success = run_inpainting(
-        in_dir=os.path.join(camelia_temp, "images"),
-        mask_dir=os.path.join(camelia_temp, "masks"),
-        out_dir=camelia_output,
-        checkpoint=os.path.join(workspace_root, "lama-inpainting", "pretrained", "best"),
-        inpainting_script=os.path.join(workspace_root, "lama-inpainting", "bin", "uncen.py"),
-        workspace_root=workspace_root
+    # Segmentation and inpainting run in this process with models loaded once
+    print(f"Running segmentation and inpainting with model type: {args.model_type}", flush=True)
+    apply_thread_budget(resolve_thread_budget(args.threads, args.interop_threads, args.image_workers))
+    pipeline = CameliaPipeline(
+        checkpoint=DEFAULT_CHECKPOINT,
+        device=args.device,
+        inpaint_options={
+            "batch_size": args.inpaint_batch_size,
+            "fft_friendly": args.fft_friendly,
+            "buckets": args.inpaint_buckets,
+            "max_crop_size": args.inpaint_max_size,
+            "detail_strength": args.detail_strength,
+            "refine": args.refine,
+            "refine_min_size": args.refine_min_size,
+            "refine_time_budget": args.refine_time_budget
+        },
+        tile_options={} if args.tiled_segmentation else None,
+        precision=args.precision,
+        channels_last=args.channels_last,
+        segment_batch_size=args.batch_size,
+        result_cache=ResultCache(os.path.join(workspace_root, "camelia-decensor", "cache")) if args.cache else None
     )
-    
-    if not inpainting_success:
-        print("Inpainting failed. Exiting pipeline.", flush=True)
-        return
+    temp_dir = camelia_temp if args.save_temp else None
+    if args.image_workers > 1:
+        # Each worker thread takes every n-th image, the models are shared
+        items = collect_images(input_dir)
+        image_worker = PipelineWorker(pipeline=pipeline, max_jobs=args.image_workers)
+        futures = [image_worker.submit(CameliaPipeline.process_files, items[index::args.image_workers],
+                                       camelia_output, args.model_type, temp_dir=temp_dir)
+                   for index in range(args.image_workers)]
+        results = [result for future in futures for result in future.result()]
+        image_worker.stop()
+    else:
+        results = pipeline.process_directory(
+            input_dir=input_dir,
+            output_dir=camelia_output,
+            model_type=args.model_type,
+            temp_dir=temp_dir
+        )
+    print(f"Processed {len(results)} image(s)", flush=True)
     
     # Clean up temporary directory if args is set
     if args.clean_temp:
@@ -228,4 +150,4 @@ def main():
     print("Processing complete!")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
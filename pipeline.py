@@ -0,0 +1,532 @@
+import hashlib
+import io
+import json
+import os
+import sys
+import threading
+import time
+from collections import deque, namedtuple
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import cv2
+import numpy as np
+from PIL import Image
+
+WORKSPACE_ROOT = os.path.dirname(os.path.abspath(__file__))
+SEGMENTATION_ROOT = os.path.join(WORKSPACE_ROOT, "smp-segmentation")
+LAMA_ROOT = os.path.join(WORKSPACE_ROOT, "lama-inpainting")
+DEFAULT_CHECKPOINT = os.path.join(LAMA_ROOT, "pretrained", "best")
+
+# Both stages are plain scripts rather than packages, so make them importable
+for path in (SEGMENTATION_ROOT, LAMA_ROOT, os.path.join(LAMA_ROOT, "bin")):
+    if path not in sys.path:
+        sys.path.insert(0, path)
+
+import torch
+import run_segmentation
+import uncen
+
+MODEL_TYPES = tuple(run_segmentation.MODEL_PATHS)
+IMAGE_EXTENSIONS = run_segmentation.IMAGE_EXTENSIONS
+
+# CPU threads of one process: intra-op threads per image and images processed at once
+# (0 intra_op / inter_op means automatic, see resolve_thread_budget)
+ThreadBudget = namedtuple("ThreadBudget", ["intra_op", "inter_op", "image_workers"])
+
+def get_relative_path(full_path, workspace_root=WORKSPACE_ROOT):
+    """Convert a full path to a relative path from workspace root."""
+    if full_path.startswith(workspace_root):
+        return full_path[len(workspace_root):].lstrip(os.sep)
+    return full_path
+
+def read_image(image_path):
+    """Decode an image file into an RGB uint8 array."""
+    image = cv2.imread(image_path)
+    if image is not None:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+    # Fall back to PIL for formats the OpenCV build cannot decode
+    try:
+        return np.array(Image.open(image_path).convert("RGB"))
+    except Exception:
+        raise ValueError(f"Failed to load image: {image_path}")
+
+def decode_image(data):
+    """Decode encoded image bytes (e.g. an upload) into an RGB uint8 array."""
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is not None:
+        return cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+
+    try:
+        return np.array(Image.open(io.BytesIO(data)).convert("RGB"))
+    except Exception:
+        raise ValueError("Failed to decode image")
+
+def load_source(source):
+    """Turn an image path, encoded bytes or an already decoded RGB array into an RGB array."""
+    if isinstance(source, np.ndarray):
+        return source
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        return decode_image(source)
+    return read_image(source)
+
+def write_image(image_path, image):
+    """Encode an RGB uint8 array to the given path."""
+    os.makedirs(os.path.dirname(image_path) or ".", exist_ok=True)
+    cv2.imwrite(image_path, cv2.cvtColor(image, cv2.COLOR_RGB2BGR))
+
+def available_cpus():
+    """Number of cores this process may run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+def resolve_thread_budget(intra_op=0, inter_op=0, image_workers=1, cpu_count=None):
+    """
+    Fill in the automatic parts of a thread budget.
+
+    With intra_op 0 the available cores are split evenly between the
+    image_workers images processed at the same time. inter_op 0 leaves torch's
+    inter-op pool as is, the pipeline does not run parallel graph branches.
+    """
+    image_workers = max(1, image_workers)
+    if not intra_op:
+        intra_op = max(1, (cpu_count or available_cpus()) // image_workers)
+    return ThreadBudget(intra_op, inter_op, image_workers)
+
+def apply_thread_budget(budget, log=print):
+    """
+    Apply a thread budget to torch and OpenCV for the whole process.
+
+    Call it once at startup, before the first inference: torch only accepts
+    the inter-op thread count before its inter-op pool has started.
+    """
+    torch.set_num_threads(budget.intra_op)
+    cv2.setNumThreads(budget.intra_op)
+    if budget.inter_op:
+        try:
+            torch.set_num_interop_threads(budget.inter_op)
+        except RuntimeError as e:
+            log(f"Could not set inter-op threads: {e}")
+    log(f"CPU threads: {budget.intra_op} per image, {budget.image_workers} image(s) at a time")
+
+def collect_images(input_dir):
+    """List (image_path, relative_output_path) pairs for every image under input_dir."""
+    items = []
+    for root, _, files in os.walk(input_dir):
+        relative_path = os.path.relpath(root, input_dir)
+        for file in sorted(files):
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                output_filename = os.path.splitext(file)[0] + '.png'
+                items.append((os.path.join(root, file), os.path.normpath(os.path.join(relative_path, output_filename))))
+    return items
+
+
+class StageTimer:
+    """Times the pipeline stages of one image and reports each one as an event."""
+
+    def __init__(self, name, on_event=None):
+        self.name = name
+        self.on_event = on_event
+        self.timings = {}
+        self.start = time.perf_counter()
+
+    @contextmanager
+    def stage(self, stage):
+        start = time.perf_counter()
+        yield
+        self.record(stage, (time.perf_counter() - start) * 1000)
+
+    def record(self, stage, duration_ms):
+        self.timings[stage] = round(duration_ms, 2)
+        if self.on_event is not None:
+            self.on_event({"type": "stage", "image": self.name, "stage": stage, "ms": self.timings[stage]})
+
+    def total_ms(self):
+        return round((time.perf_counter() - self.start) * 1000, 2)
+
+
+class StageMetrics:
+    """Thread-safe aggregate of the stage and image events produced by CameliaPipeline."""
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.samples = {}
+        self.counts = {"images": 0, "errors": 0, "regions": 0}
+        self._lock = threading.Lock()
+
+    def record(self, event):
+        with self._lock:
+            if event["type"] == "stage":
+                self.samples.setdefault(event["stage"], deque(maxlen=self.window)).append(event["ms"])
+            elif event["type"] == "image":
+                self.counts["images"] += 1
+                self.counts["regions"] += event.get("regions", 0)
+                self.samples.setdefault("total", deque(maxlen=self.window)).append(event["ms"])
+            elif event["type"] == "error":
+                self.counts["errors"] += 1
+
+    def snapshot(self):
+        """Counters plus count/mean/p50/p95/max in ms per stage over the most recent samples."""
+        with self._lock:
+            stages = {}
+            for stage, values in self.samples.items():
+                ordered = sorted(values)
+                stages[stage] = {
+                    "count": len(ordered),
+                    "mean_ms": round(sum(ordered) / len(ordered), 2),
+                    "p50_ms": ordered[len(ordered) // 2],
+                    "p95_ms": ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))],
+                    "max_ms": ordered[-1],
+                }
+            return dict(self.counts, stages=stages)
+
+
+class CameliaPipeline:
+    """
+    Segmentation -> mask -> inpainting in a single process.
+
+    The UNet++ segmenters (one per model type) and the LaMa generator are loaded
+    on first use and stay resident, so consecutive images and batches only pay
+    for model compute.
+    """
+
+    def __init__(self, checkpoint=DEFAULT_CHECKPOINT, device=None, log=None, inpaint_options=None, tile_options=None,
+                 precision="fp32", channels_last=False, result_cache=None, segment_batch_size=1):
+        if device is None:
+            device = "cuda" if torch.cuda.is_available() else "cpu"
+        self.checkpoint = checkpoint
+        self.device = torch.device(device)
+        self.log = log or (lambda message: print(message, flush=True))
+        # Extra keyword arguments for uncen.inpaint, e.g. batch_size, fft_friendly, buckets, max_crop_size or refine
+        self.inpaint_options = dict(inpaint_options or {})
+        # Keyword arguments for run_segmentation.predict_mask_tiled, None segments the resized image
+        self.tile_options = tile_options
+        # Segmentation inference precision and memory format, see run_segmentation.load_model
+        self.precision = precision
+        self.channels_last = channels_last
+        # Images stacked into one segmentation forward pass by process_files
+        self.segment_batch_size = max(1, segment_batch_size)
+        # Optional result_cache.ResultCache, looked up by process_files before running the models
+        self.result_cache = result_cache
+        self.segmentation_models = {}
+        self.inpaint_model = None
+        self._load_lock = threading.Lock()
+
+    def get_segmentation_model(self, model_type):
+        """Return the segmentation model for model_type, loading it once."""
+        with self._load_lock:
+            if model_type not in self.segmentation_models:
+                model_path = os.path.join(SEGMENTATION_ROOT, run_segmentation.MODEL_PATHS[model_type])
+                self.log(f"Loading segmentation model: {get_relative_path(model_path)}")
+                self.segmentation_models[model_type] = run_segmentation.load_model(
+                    model_path, device=self.device, precision=self.precision, channels_last=self.channels_last)
+            return self.segmentation_models[model_type]
+
+    def get_inpaint_model(self):
+        """Return the LaMa inpainting model, loading it once."""
+        with self._load_lock:
+            if self.inpaint_model is None:
+                self.log(f"Using checkpoint: {get_relative_path(os.path.abspath(self.checkpoint))}")
+                # Refinement splits the eager generator, so it cannot use the exported one
+                model = uncen.init_inpaint_model(self.checkpoint,
+                                                 use_exported=not self.inpaint_options.get("refine", False))
+                model.to(self.device)
+                self.inpaint_model = model
+            return self.inpaint_model
+
+    def get_weight_hash(self, model_type=None):
+        """Hash of the segmentation weights of model_type, or of the inpainting weights for None."""
+        if model_type is None:
+            path = os.path.join(self.checkpoint, "models", "best.ckpt")
+            if not os.path.exists(path):
+                path = os.path.join(self.checkpoint, "models", "generator.ts")
+        else:
+            path = os.path.join(SEGMENTATION_ROOT, run_segmentation.MODEL_PATHS[model_type])
+        # Memoised in run_segmentation, shared with the compiled artifact lookup of load_model
+        return run_segmentation.weights_hash(path)
+
+    def cache_key(self, data, model_type):
+        """
+        Result cache key of encoded image bytes processed with model_type.
+
+        Covers the weights of both stages and every option that changes the
+        output, so changing any of them never serves a stale result.
+        """
+        settings = {
+            "model_type": model_type,
+            "weights": [self.get_weight_hash(model_type), self.get_weight_hash()],
+            "inpaint_options": self.inpaint_options,
+            "tile_options": self.tile_options,
+            "precision": self.precision,
+        }
+        digest = hashlib.sha256(data)
+        digest.update(json.dumps(settings, sort_keys=True, default=str).encode())
+        return digest.hexdigest()
+
+    def segment(self, image, model_type):
+        """Predict the full-resolution uint8 mask for an RGB image."""
+        return self.segment_batch([image], model_type)[0]
+
+    def segment_batch(self, images, model_type, tensor_images=None):
+        """
+        Predict the full-resolution uint8 masks of several RGB images in one forward pass.
+
+        tensor_images are the images already preprocessed with
+        run_segmentation.preprocess_array, e.g. on a loader thread. With
+        tile_options every image is segmented on its own with tiles instead.
+        """
+        model = self.get_segmentation_model(model_type)
+        if self.tile_options is not None:
+            predicted_masks = [run_segmentation.predict_mask_tiled(model, image, **self.tile_options)
+                               for image in images]
+        else:
+            if tensor_images is None:
+                tensor_images = [run_segmentation.preprocess_array(image, device="cpu") for image in images]
+            predicted_masks = run_segmentation.predict_masks(model, torch.cat(tensor_images))
+        return [run_segmentation.resize_mask(run_segmentation.create_opacity_mask(predicted_mask), image.shape)
+                for image, predicted_mask in zip(images, predicted_masks)]
+
+    def inpaint(self, image, mask, stats=None, region_results=None):
+        """
+        Inpaint the masked areas of an RGB image, returns (output, debug_image).
+
+        If a stats dict is given it receives the region count and the region search time.
+        region_results carries the crop results of earlier calls on the same
+        image, see uncen.inpaint.
+        """
+        if mask.ndim == 2:
+            mask = mask[..., None]
+        return uncen.inpaint(self.get_inpaint_model(), image, mask[..., :1], stats=stats,
+                             region_results=region_results, **self.inpaint_options)
+
+    def warmup(self, model_types=()):
+        """
+        Run the models once at the shapes they will see so the first request runs at steady-state speed.
+
+        Every segmentation model of model_types runs once at its input size and
+        every batch size up to segment_batch_size, and the inpainting generator
+        runs once per shape bucket in inpaint_options.
+        """
+        start = time.perf_counter()
+        image = np.zeros((run_segmentation.IMAGE_SIZE, run_segmentation.IMAGE_SIZE, 3), dtype=np.uint8)
+        for model_type in model_types:
+            for count in range(1, self.segment_batch_size + 1):
+                self.segment_batch([image] * count, model_type)
+
+        sizes = []
+        buckets = self.inpaint_options.get("buckets")
+        if buckets:
+            sizes = uncen.warmup(self.get_inpaint_model(), buckets,
+                                 batch_size=self.inpaint_options.get("batch_size", 1),
+                                 fft_friendly=self.inpaint_options.get("fft_friendly", False))
+        self.log(f"Warm-up finished in {(time.perf_counter() - start) * 1000:.0f} ms"
+                 + (f", inpainting buckets: {', '.join(map(str, sizes))}" if sizes else ""))
+
+    def process(self, image, model_type):
+        """Run the full pipeline on an RGB image, returns (mask, output, debug_image)."""
+        mask = self.segment(image, model_type)
+        output, dbg = self.inpaint(image, mask)
+        return mask, output, dbg
+
+    def process_files(self, items, output_dir, model_type, temp_dir=None, debug_dir=None, should_stop=None, log=None,
+                      on_result=None, on_event=None, on_image=None):
+        """
+        Process a list of (source, relative_output_path) pairs.
+
+        Args:
+            items: Images to process and where to store them relative to output_dir.
+                A source is an image path, encoded image bytes or an RGB array;
+                bytes are decoded once in memory.
+            output_dir: Directory for the inpainted results.
+            model_type: Segmentation model type.
+            temp_dir: If set, the original images and masks are also dumped as PNGs
+                under temp_dir/images and temp_dir/masks. The stages never read
+                them back, this is only for debugging and inspection.
+            debug_dir: If set, inpainting debug images are saved there.
+            should_stop: Optional callable checked between images to cancel the run.
+            log: Optional callable receiving progress messages, defaults to the pipeline's log.
+            on_result: Optional callable receiving (relative_output_path, output_path) as
+                soon as each image is written.
+            on_image: Optional callable receiving (relative_output_path, image, mask, output, region_results)
+                with the decoded arrays and region crops of each inpainted image, e.g. to keep them
+                for mask edits. Not called for images served from the result cache.
+            on_event: Optional callable receiving a dict per finished stage
+                ({"type": "stage", "stage": ..., "ms": ...}), per finished image
+                ({"type": "image", "ms": ..., "regions": ..., "width": ..., "height": ...,
+                "timings": {...}}) and per failed image ({"type": "error", ...}).
+                Images served from the result cache add "cached": True to their image event.
+
+        Images are read, decoded and preprocessed on a loader thread one batch
+        ahead, and segment_batch_size of them share a segmentation forward pass
+        before being inpainted one by one.
+
+        With a result cache, path and bytes sources are looked up by content before
+        decoding, and new results are stored once written. Decoded arrays and runs
+        with debug_dir always go through the models.
+
+        Returns:
+            List of (relative_output_path, output_path) for every successfully processed image.
+        """
+        log = log or self.log
+        results = []
+        use_cache = self.result_cache is not None and not debug_dir
+        # Cache hits are served without decoding anything unless temp_dir wants the image and mask
+        needs_arrays = bool(temp_dir)
+
+        def prepare(source, output_path):
+            # Runs on the loader thread: cache lookup, decode and preprocessing of one image.
+            # Returns a dict with the image, its tensor, the cache key, a cache hit and stage timings.
+            prepared = {"timings": {}, "cache_key": None, "cached": None, "image": None, "tensor": None}
+            if use_cache and not isinstance(source, np.ndarray):
+                start = time.perf_counter()
+                if isinstance(source, str):
+                    with open(source, "rb") as f:
+                        source = f.read()
+                prepared["cache_key"] = self.cache_key(source, model_type)
+                prepared["cached"] = self.result_cache.get(prepared["cache_key"], output_path, with_mask=needs_arrays)
+                prepared["timings"]["cache_lookup"] = (time.perf_counter() - start) * 1000
+                if prepared["cached"] is not None and not needs_arrays:
+                    return prepared
+
+            start = time.perf_counter()
+            prepared["image"] = load_source(source)
+            if prepared["cached"] is None and self.tile_options is None:
+                prepared["tensor"] = run_segmentation.preprocess_array(prepared["image"], device="cpu")
+            prepared["timings"]["decode"] = (time.perf_counter() - start) * 1000
+            return prepared
+
+        def fail(name, relative_output_path, e):
+            log(f"Error processing {name}: {e}")
+            if on_event is not None:
+                on_event({"type": "error", "image": relative_output_path, "error": str(e)})
+
+        def finish_cached(name, relative_output_path, output_path, timer, prepared):
+            mask, metadata = prepared["cached"]
+            if temp_dir:
+                run_segmentation.save_image_and_mask(prepared["image"], mask, temp_dir, relative_output_path)
+            results.append((relative_output_path, output_path))
+
+            total_ms = timer.total_ms()
+            log(f"Finished {name} from cache in {total_ms:.0f} ms")
+            if on_event is not None:
+                on_event(dict(metadata, type="image", image=relative_output_path, ms=total_ms,
+                              timings=timer.timings, cached=True))
+            if on_result is not None:
+                on_result(relative_output_path, output_path)
+
+        def finish(name, relative_output_path, output_path, timer, prepared, mask):
+            image = prepared["image"]
+            if temp_dir:
+                run_segmentation.save_image_and_mask(image, mask, temp_dir, relative_output_path)
+
+            stats = {}
+            inpaint_start = time.perf_counter()
+            region_results = {} if on_image is not None else None
+            output, dbg = self.inpaint(image, mask, stats=stats, region_results=region_results)
+            inpaint_ms = (time.perf_counter() - inpaint_start) * 1000
+            timer.record("region_find", stats.get("region_find_ms", 0))
+            timer.record("inpaint", inpaint_ms - stats.get("region_find_ms", 0))
+
+            with timer.stage("encode"):
+                write_image(output_path, output)
+            if debug_dir:
+                write_image(os.path.join(debug_dir, relative_output_path), dbg)
+            results.append((relative_output_path, output_path))
+
+            height, width = image.shape[:2]
+            total_ms = timer.total_ms()
+            log(f"Finished {name} ({width}x{height}, {stats.get('regions', 0)} region(s)) in {total_ms:.0f} ms: "
+                + ", ".join(f"{stage} {ms:.0f} ms" for stage, ms in timer.timings.items()))
+            if on_event is not None:
+                on_event({"type": "image", "image": relative_output_path, "ms": total_ms,
+                          "width": width, "height": height, "regions": stats.get("regions", 0),
+                          "timings": timer.timings})
+            if on_image is not None:
+                on_image(relative_output_path, image, mask, output, region_results)
+            if on_result is not None:
+                on_result(relative_output_path, output_path)
+
+            if prepared["cache_key"] is not None:
+                # The image is done, a failed store only costs a future cache hit
+                try:
+                    self.result_cache.put(prepared["cache_key"], mask, output_path,
+                                          {"width": width, "height": height, "regions": stats.get("regions", 0)})
+                except Exception as e:
+                    log(f"Warning: could not store {name} in the result cache: {e}")
+
+        batch_size = self.segment_batch_size
+        chunks = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+        loader = ThreadPoolExecutor(max_workers=1, thread_name_prefix="camelia-loader")
+
+        def submit_loads(chunk):
+            loads = []
+            for source, relative_output_path in chunk:
+                output_path = os.path.join(output_dir, relative_output_path)
+                loads.append((source, relative_output_path, output_path,
+                              loader.submit(prepare, source, output_path)))
+            return loads
+
+        try:
+            loaded = submit_loads(chunks[0]) if chunks else []
+            for index in range(len(chunks)):
+                if should_stop is not None and should_stop():
+                    log("Processing cancelled")
+                    return results
+                current = loaded
+                # Decode the next batch while this one is segmented and inpainted
+                loaded = submit_loads(chunks[index + 1]) if index + 1 < len(chunks) else []
+
+                batch = []
+                for source, relative_output_path, output_path, future in current:
+                    name = get_relative_path(source) if isinstance(source, str) else relative_output_path
+                    log(f"Processing: {name}")
+                    timer = StageTimer(relative_output_path, on_event)
+                    try:
+                        prepared = future.result()
+                        for stage, duration_ms in prepared["timings"].items():
+                            timer.record(stage, duration_ms)
+                        if prepared["cached"] is not None:
+                            timer.start = time.perf_counter() - sum(timer.timings.values()) / 1000
+                            finish_cached(name, relative_output_path, output_path, timer, prepared)
+                        else:
+                            batch.append((name, relative_output_path, output_path, timer, prepared))
+                    except Exception as e:
+                        fail(name, relative_output_path, e)
+
+                if not batch:
+                    continue
+
+                try:
+                    segment_start = time.perf_counter()
+                    masks = self.segment_batch([prepared["image"] for *_, prepared in batch], model_type,
+                                               tensor_images=None if self.tile_options is not None
+                                               else [prepared["tensor"] for *_, prepared in batch])
+                    # One forward pass for the whole batch, each image is charged its share
+                    segment_ms = (time.perf_counter() - segment_start) * 1000 / len(batch)
+                except Exception as e:
+                    for name, relative_output_path, *_ in batch:
+                        fail(name, relative_output_path, e)
+                    continue
+
+                for (name, relative_output_path, output_path, timer, prepared), mask in zip(batch, masks):
+                    if should_stop is not None and should_stop():
+                        log("Processing cancelled")
+                        return results
+                    timer.record("segment", segment_ms)
+                    prepared["tensor"] = None
+                    # Loading ran ahead on the loader thread and the batch was segmented together,
+                    # so the total counts this image's stages rather than the time since it was queued
+                    timer.start = time.perf_counter() - sum(timer.timings.values()) / 1000
+                    try:
+                        finish(name, relative_output_path, output_path, timer, prepared, mask)
+                    except Exception as e:
+                        fail(name, relative_output_path, e)
+        finally:
+            loader.shutdown(wait=True, cancel_futures=True)
+        return results
+
+    def process_directory(self, input_dir, output_dir, model_type, **kwargs):
+        """Process every image under input_dir, mirroring its structure under output_dir."""
+        return self.process_files(collect_images(input_dir), output_dir, model_type, **kwargs)
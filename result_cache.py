@@ -0,0 +1,203 @@
+import json
+import os
+import shutil
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+
+import cv2
+
+MASK_FILENAME = "mask.png"
+OUTPUT_FILENAME = "output.png"
+META_FILENAME = "meta.json"
+
+# Decoded arrays of one processed image: RGB input, the single-channel mask its output was inpainted with,
+# RGB output and the per-region crop results of uncen.inpaint (region_results, None when unknown)
+SessionEntry = namedtuple("SessionEntry", ["image", "mask", "output", "regions"])
+
+
+class ResultCache:
+    """
+    Content-addressed cache of pipeline results on local disk.
+
+    Entries are keyed on the sha256 of the encoded input image, the model type,
+    the hashes of the weights and the pipeline options (see
+    CameliaPipeline.cache_key), so an identical upload processed the same way
+    maps to the same entry. Each entry holds the predicted mask, the final
+    output and a small metadata file. Once the entries exceed max_bytes the
+    least recently used ones are evicted; reads refresh an entry's mtime.
+    """
+
+    def __init__(self, root, max_bytes=2 * 1024 ** 3):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.entries = self._scan()
+
+    def _entry_dir(self, key):
+        return os.path.join(self.root, key[:2], key)
+
+    def _scan(self):
+        """Size of every complete entry on disk, keyed by cache key."""
+        entries = {}
+        for prefix in os.listdir(self.root):
+            prefix_dir = os.path.join(self.root, prefix)
+            if not os.path.isdir(prefix_dir):
+                continue
+            for key in os.listdir(prefix_dir):
+                entry_dir = os.path.join(prefix_dir, key)
+                if key.endswith(".tmp") or not os.path.exists(os.path.join(entry_dir, META_FILENAME)):
+                    # Left behind by an interrupted write
+                    shutil.rmtree(entry_dir, ignore_errors=True)
+                    continue
+                entries[key] = sum(entry.stat().st_size for entry in os.scandir(entry_dir))
+        return entries
+
+    def get(self, key, output_path, with_mask=True):
+        """
+        Copy a cached output to output_path and return (mask, metadata), or None on a miss.
+
+        Only the index lookup holds the lock, the files are read outside it. An
+        entry evicted or damaged in the meantime counts as a miss. mask is None
+        unless with_mask is set.
+        """
+        entry_dir = self._entry_dir(key)
+        with self._lock:
+            if key not in self.entries:
+                return None
+            try:
+                # Refreshed before reading so a concurrent eviction picks older entries first
+                os.utime(entry_dir)
+            except OSError:
+                self.entries.pop(key, None)
+                return None
+
+        try:
+            with open(os.path.join(entry_dir, META_FILENAME)) as f:
+                metadata = json.load(f)
+            mask = None
+            if with_mask:
+                mask = cv2.imread(os.path.join(entry_dir, MASK_FILENAME), cv2.IMREAD_GRAYSCALE)
+                if mask is None:
+                    raise FileNotFoundError(os.path.join(entry_dir, MASK_FILENAME))
+            os.makedirs(os.path.dirname(output_path) or ".", exist_ok=True)
+            shutil.copyfile(os.path.join(entry_dir, OUTPUT_FILENAME), output_path)
+        except (OSError, ValueError):
+            with self._lock:
+                # Left alone if it was evicted and stored again in the meantime
+                if key in self.entries and not os.path.exists(os.path.join(entry_dir, META_FILENAME)):
+                    self.entries.pop(key)
+            return None
+        return mask, metadata
+
+    def put(self, key, mask, output_path, metadata=None):
+        """
+        Store a result and evict old entries past max_bytes.
+
+        mask is the uint8 mask array, output_path the already encoded output,
+        which is copied rather than encoded again.
+        """
+        entry_dir = self._entry_dir(key)
+        # Written next to the entry and renamed, so readers never see a partial entry
+        staging_dir = f"{entry_dir}.{uuid.uuid4().hex}.tmp"
+        os.makedirs(staging_dir)
+        try:
+            cv2.imwrite(os.path.join(staging_dir, MASK_FILENAME), mask)
+            shutil.copyfile(output_path, os.path.join(staging_dir, OUTPUT_FILENAME))
+            with open(os.path.join(staging_dir, META_FILENAME), "w") as f:
+                json.dump(metadata or {}, f)
+            size = sum(entry.stat().st_size for entry in os.scandir(staging_dir))
+
+            with self._lock:
+                if key in self.entries:
+                    return
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                os.replace(staging_dir, entry_dir)
+                self.entries[key] = size
+                self._evict()
+        finally:
+            shutil.rmtree(staging_dir, ignore_errors=True)
+
+    def _evict(self):
+        total = sum(self.entries.values())
+        if total <= self.max_bytes:
+            return
+        by_age = sorted(self.entries, key=lambda key: os.path.getmtime(self._entry_dir(key)))
+        for key in by_age:
+            if total <= self.max_bytes:
+                break
+            total -= self.entries.pop(key)
+            shutil.rmtree(self._entry_dir(key), ignore_errors=True)
+
+    def stats(self):
+        """Entry count and total size, e.g. for /api/metrics."""
+        with self._lock:
+            return {"entries": len(self.entries), "bytes": sum(self.entries.values()), "max_bytes": self.max_bytes}
+
+
+class SessionCache:
+    """
+    In-memory cache of the decoded images, masks and outputs of API sessions.
+
+    Lets mask edits of a session reuse the decoded image, the previous output
+    and the inpainted regions the edit did not touch. Entries expire ttl seconds
+    after their last use, and the least recently used ones are dropped once
+    their arrays exceed max_bytes.
+    """
+
+    def __init__(self, ttl=1800, max_bytes=1024 ** 3):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        # (session_id, name) -> (SessionEntry, size, last_used), least recently used first
+        self.entries = OrderedDict()
+
+    def get(self, session_id, name):
+        """Return the SessionEntry of an image, or None."""
+        with self._lock:
+            self._expire()
+            item = self.entries.pop((session_id, name), None)
+            if item is None:
+                return None
+            entry, size, _ = item
+            self.entries[(session_id, name)] = (entry, size, time.monotonic())
+            return entry
+
+    def put(self, session_id, name, image, mask, output, regions=None):
+        """Store the arrays of an image, replacing any previous entry."""
+        if mask.ndim == 3:
+            mask = mask[..., 0]
+        entry = SessionEntry(image, mask, output, regions)
+        size = image.nbytes + mask.nbytes + output.nbytes + sum(result.nbytes for result in (regions or {}).values())
+        with self._lock:
+            self.entries.pop((session_id, name), None)
+            if size > self.max_bytes:
+                return
+            self.entries[(session_id, name)] = (entry, size, time.monotonic())
+            self._expire()
+            total = sum(size for _, size, _ in self.entries.values())
+            while total > self.max_bytes:
+                _, (_, size, _) = self.entries.popitem(last=False)
+                total -= size
+
+    def drop_session(self, session_id):
+        """Forget every image of a session."""
+        with self._lock:
+            for key in [key for key in self.entries if key[0] == session_id]:
+                del self.entries[key]
+
+    def _expire(self):
+        now = time.monotonic()
+        while self.entries:
+            key, (_, _, last_used) = next(iter(self.entries.items()))
+            if now - last_used <= self.ttl:
+                break
+            del self.entries[key]
+
+    def stats(self):
+        """Entry count and total size of the cached arrays."""
+        with self._lock:
+            return {"entries": len(self.entries), "bytes": sum(size for _, size, _ in self.entries.values()),
+                    "max_bytes": self.max_bytes}
@@ -1,8 +1,14 @@
 import os
+import glob
+import hashlib
+import threading
 import cv2
 import torch
 import numpy as np
 import argparse
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
 import segmentation_models_pytorch as smp
 from albumentations import Compose, Normalize, Resize
 from albumentations.pytorch import ToTensorV2
@@ -11,7 +17,14 @@ import tempfile
 
 DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
 IMAGE_SIZE = 1024
+TILE_OVERLAP = 128
+MAX_TILES = 64
 DEFAULT_OUTPUT_DIR = "output/"
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.webp')
+
+# Weights stay in fp32, lower precisions run the forward pass under autocast
+PRECISIONS = ("fp32", "bf16", "fp16")
+AUTOCAST_DTYPES = {"bf16": torch.bfloat16, "fp16": torch.float16}
 
 MODEL_PATHS = {
     "black_bars": "pretrained/best_black_bars_model.pth",
@@ -25,13 +38,28 @@ preprocess_pipeline = Compose([
     ToTensorV2()
 ])
 
+# Tiles are cut at native resolution, so they are only normalized
+tile_pipeline = Compose([
+    Normalize(),
+    ToTensorV2()
+])
+
 def get_input_dir(model_type, base_input_dir="input"):
     """Get input directory based on model type."""
     return os.path.join(base_input_dir, model_type)
 
-def load_model(model_path):
-    """Load the trained model from the specified path."""
-    checkpoint = torch.load(model_path, map_location=DEVICE)
+def resolve_precision(precision, device=DEVICE):
+    """Return the precision actually used on device, fp16 falls back to bf16 without CUDA."""
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision: {precision}, expected one of {', '.join(PRECISIONS)}")
+    if precision == "fp16" and torch.device(device).type != "cuda":
+        print("fp16 needs CUDA, using bf16 instead")
+        return "bf16"
+    return precision
+
+def build_model(model_path, device=DEVICE):
+    """Build the eager UNet++ model and load the trained weights into it."""
+    checkpoint = torch.load(model_path, map_location=device)
     if "model_state_dict" in checkpoint:
         model_state_dict = checkpoint["model_state_dict"]
     else:
@@ -42,32 +70,283 @@ def load_model(model_path):
         encoder_weights=None,
         in_channels=3,
         classes=1
-    ).to(DEVICE)
+    ).to(device)
 
     model.load_state_dict(model_state_dict)
     model.eval()
     return model
 
-def preprocess_image(image_path):
+# Weights hashes by absolute path, with the size and mtime they were computed for
+_weights_hashes = {}
+_weights_hashes_lock = threading.Lock()
+
+def weights_hash(model_path):
+    """
+    Short sha256 of a weights file, used to key its compiled artifacts and cached results.
+
+    Computed once per file and reused until its size or mtime changes.
+    """
+    path = os.path.abspath(model_path)
+    stat = os.stat(path)
+    with _weights_hashes_lock:
+        cached = _weights_hashes.get(path)
+        if cached is not None and cached[:2] == (stat.st_size, stat.st_mtime_ns):
+            return cached[2]
+
+        digest = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+        _weights_hashes[path] = (stat.st_size, stat.st_mtime_ns, digest.hexdigest()[:16])
+        return _weights_hashes[path][2]
+
+def compiled_model_path(model_path, device=DEVICE, channels_last=False, precision="fp32"):
+    """
+    Path of the compiled artifact for a weights file, next to it.
+
+    Frozen graphs are specialized to the device type, memory format and
+    precision they were traced with, so all three are part of the name along
+    with the weights hash.
+    """
+    suffix = f"{weights_hash(model_path)}.{torch.device(device).type}"
+    if channels_last:
+        suffix += ".cl"
+    if precision != "fp32":
+        suffix += f".{precision}"
+    return f"{os.path.splitext(model_path)[0]}.{suffix}.ts"
+
+class CompiledSegmenter(torch.nn.Module):
+    """Wraps a frozen TorchScript segmenter so it is used like the eager model."""
+
+    def __init__(self, graph):
+        super().__init__()
+        self.graph = graph
+
+    def forward(self, tensor_images):
+        return self.graph(tensor_images)
+
+def export_model(model_path, device=DEVICE, channels_last=False, precision="fp32", atol=None):
+    """
+    Trace the segmenter with TorchScript, freeze it and save it next to the weights.
+
+    Freezing inlines the weights and folds batch norms into the convolutions,
+    and the saved graph skips the Python overhead of the eager modules. With a
+    reduced precision the graph is traced under autocast, so the casts are
+    part of it. The graph is traced with one image and checked against the
+    eager model on a batch and on a smaller, non-square input (edge tiles),
+    within atol on the logits; a graph that fails is not saved and any stale
+    artifact is removed. Returns the path of the artifact.
+    """
+    precision = resolve_precision(precision, device)
+    if atol is None:
+        atol = 1e-3 if precision == "fp32" else 5e-2
+    model = build_model(model_path, device)
+    # The memory efficient swish is a custom autograd function that cannot be traced
+    if hasattr(model.encoder, "set_swish"):
+        model.encoder.set_swish(memory_efficient=False)
+    if channels_last:
+        model.to(memory_format=torch.channels_last)
+    model.device = torch.device(device)
+    model.precision = precision
+    model.channels_last = channels_last
+
+    example = to_model_input(model, torch.zeros(1, 3, IMAGE_SIZE, IMAGE_SIZE))
+    checks = [torch.randn(2, 3, IMAGE_SIZE, IMAGE_SIZE), torch.randn(1, 3, IMAGE_SIZE // 2, IMAGE_SIZE * 3 // 4)]
+    output_path = compiled_model_path(model_path, device, channels_last, precision)
+
+    with torch.no_grad(), autocast_context(precision, device):
+        graph = torch.jit.freeze(torch.jit.trace(model, example))
+        # Run twice so the profiling executor specializes the graph before it is saved
+        graph(example)
+        graph(example)
+
+        for check in checks:
+            check = to_model_input(model, check)
+            error = (graph(check).float() - model(check).float()).abs().max().item()
+            if error > atol:
+                if os.path.exists(output_path):
+                    os.remove(output_path)
+                raise RuntimeError(f"Compiled model differs from the eager one by {error:.2e} "
+                                   f"on a {tuple(check.shape)} input")
+
+    graph.save(output_path)
+    return output_path
+
+def forward_dtype(model):
+    """dtype of the raw logits the model produces under its inference context."""
+    with inference_context(model):
+        return model(to_model_input(model, torch.zeros(1, 3, 64, 64))).dtype
+
+def load_model(model_path, device=DEVICE, precision="fp32", channels_last=False, use_compiled=True):
+    """
+    Load the trained model from the specified path.
+
+    precision selects the inference precision (see PRECISIONS) and channels_last
+    stores the weights in NHWC order, which is faster for the EfficientNet
+    convolutions on recent CPUs and on tensor cores. Both are applied by
+    inference_context and to_model_input in the predict functions.
+
+    If export_model has produced an artifact for these weights, device, memory
+    format and precision, it is loaded instead of building the eager model.
+    Its logits are checked once to come out in the dtype of the precision,
+    otherwise the eager model is used.
+    """
+    precision = resolve_precision(precision, device)
+    model = None
+    # Only hash the weights when some artifact has been exported next to them
+    if use_compiled and glob.glob(glob.escape(os.path.splitext(model_path)[0]) + ".*.ts"):
+        compiled_path = compiled_model_path(model_path, device, channels_last, precision)
+        if os.path.exists(compiled_path):
+            try:
+                model = CompiledSegmenter(torch.jit.load(compiled_path, map_location=device))
+                model.eval()
+                model.device = torch.device(device)
+                model.precision = precision
+                model.channels_last = channels_last
+                dtype = forward_dtype(model)
+                expected = AUTOCAST_DTYPES.get(precision, torch.float32)
+                if dtype != expected:
+                    raise RuntimeError(f"it runs in {dtype} instead of {expected}")
+            except Exception as e:
+                print(f"Error loading compiled model {compiled_path}, using the eager model: {e}")
+                model = None
+
+    if model is None:
+        model = build_model(model_path, device)
+        if channels_last:
+            model.to(memory_format=torch.channels_last)
+
+    model.device = torch.device(device)
+    model.precision = precision
+    model.channels_last = channels_last
+    return model
+
+@contextmanager
+def autocast_context(precision, device=DEVICE):
+    """Autocast to a reduced precision on device, nothing for fp32."""
+    if precision == "fp32":
+        yield
+    else:
+        with torch.autocast(device_type=torch.device(device).type, dtype=AUTOCAST_DTYPES[precision]):
+            yield
+
+@contextmanager
+def inference_context(model):
+    """Inference mode plus autocast to the precision the model was loaded with."""
+    with torch.inference_mode(), autocast_context(getattr(model, "precision", "fp32"), model.device):
+        yield
+
+def to_model_input(model, tensor_images):
+    """Move a batch to the model's device in the memory format the model was loaded with."""
+    tensor_images = tensor_images.to(model.device)
+    if getattr(model, "channels_last", False):
+        tensor_images = tensor_images.contiguous(memory_format=torch.channels_last)
+    return tensor_images
+
+def preprocess_image(image_path, device=DEVICE):
     """Preprocess the input image for the model."""
     image = cv2.imread(image_path)
     if image is None:
         raise ValueError(f"Failed to load image: {image_path}")
 
     original_image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    return original_image, preprocess_array(original_image, device=device)
+
+def to_grayscale(original_image):
+    """Convert an RGB image to the 3-channel grayscale the models run on."""
+    grayscale_image = cv2.cvtColor(original_image, cv2.COLOR_RGB2GRAY)
+    return cv2.cvtColor(grayscale_image, cv2.COLOR_GRAY2RGB)
+
+def preprocess_array(original_image, device=DEVICE):
+    """Preprocess an already decoded RGB image for the model."""
     # Convert the image to grayscale for inference
-    grayscale_image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
-    grayscale_image = cv2.cvtColor(grayscale_image, cv2.COLOR_GRAY2RGB)
+    grayscale_image = to_grayscale(original_image)
 
     processed = preprocess_pipeline(image=grayscale_image)
-    tensor_image = processed["image"].unsqueeze(0).to(DEVICE)
-    return original_image, tensor_image
+    return processed["image"].unsqueeze(0).to(device)
 
 def predict_mask(model, tensor_image):
     """Generate a mask prediction using the model."""
-    with torch.no_grad():
-        prediction = model(tensor_image)
-        return prediction.squeeze().sigmoid().cpu().numpy()
+    with inference_context(model):
+        prediction = model(to_model_input(model, tensor_image))
+        return prediction.squeeze().float().sigmoid().cpu().numpy()
+
+def predict_masks(model, tensor_images):
+    """Generate mask predictions for a batch of images stacked along the first dimension."""
+    with inference_context(model):
+        prediction = model(to_model_input(model, tensor_images))
+        return list(prediction[:, 0].float().sigmoid().cpu().numpy())
+
+def tile_starts(length, tile_size, stride):
+    """Start offsets of tiles covering [0, length), the last tile is aligned to the end."""
+    if length <= tile_size:
+        return [0]
+    starts = list(range(0, length - tile_size, stride))
+    starts.append(length - tile_size)
+    return starts
+
+def tile_weight(tile_size, overlap):
+    """Blending weights of a tile: linear ramps across the overlap, flat in the middle."""
+    ramp = np.ones(tile_size, dtype=np.float32)
+    if overlap > 0:
+        edge = np.linspace(0, 1, overlap + 2, dtype=np.float32)[1:-1]
+        ramp[:overlap] = edge
+        ramp[-overlap:] = edge[::-1]
+    return np.outer(ramp, ramp)
+
+def predict_mask_tiled(model, original_image, tile_size=IMAGE_SIZE, overlap=TILE_OVERLAP, max_tiles=MAX_TILES,
+                       batch_size=4):
+    """
+    Predict a full-resolution mask with overlapping tiles instead of squashing the image to IMAGE_SIZE.
+
+    Tiles are run batch_size at a time and their logits are blended with linear
+    ramps across the overlap. If covering the image takes more than max_tiles
+    tiles, the image is downscaled just enough to fit and the mask is scaled back.
+    Only one batch of tiles is normalized at a time, so memory stays bounded.
+
+    Returns:
+        Mask probabilities with the same height and width as the image.
+    """
+    h, w = original_image.shape[:2]
+    overlap = min(overlap, tile_size // 2)
+    stride = tile_size - overlap
+
+    def count_tiles(height, width):
+        return len(tile_starts(height, tile_size, stride)) * len(tile_starts(width, tile_size, stride))
+
+    scale = 1.0
+    while max_tiles and count_tiles(int(h * scale), int(w * scale)) > max_tiles:
+        scale *= 0.9
+
+    grayscale_image = to_grayscale(original_image)
+    if scale < 1.0:
+        grayscale_image = cv2.resize(grayscale_image, (max(1, int(w * scale)), max(1, int(h * scale))),
+                                     interpolation=cv2.INTER_AREA)
+
+    # Images smaller than a tile are mirrored up to the tile size
+    sh, sw = grayscale_image.shape[:2]
+    ph, pw = max(sh, tile_size), max(sw, tile_size)
+    if (ph, pw) != (sh, sw):
+        grayscale_image = cv2.copyMakeBorder(grayscale_image, 0, ph - sh, 0, pw - sw, cv2.BORDER_REFLECT_101)
+
+    weight = tile_weight(tile_size, overlap)
+    logits = np.zeros((ph, pw), dtype=np.float32)
+    weights = np.zeros((ph, pw), dtype=np.float32)
+    positions = [(y, x) for y in tile_starts(ph, tile_size, stride) for x in tile_starts(pw, tile_size, stride)]
+
+    for start in range(0, len(positions), batch_size):
+        chunk = positions[start:start + batch_size]
+        tiles = [tile_pipeline(image=grayscale_image[y:y + tile_size, x:x + tile_size])["image"] for y, x in chunk]
+        with inference_context(model):
+            prediction = model(to_model_input(model, torch.stack(tiles)))[:, 0].float().cpu().numpy()
+        for (y, x), tile_logits in zip(chunk, prediction):
+            logits[y:y + tile_size, x:x + tile_size] += tile_logits * weight
+            weights[y:y + tile_size, x:x + tile_size] += weight
+
+    probabilities = 1 / (1 + np.exp(-logits[:sh, :sw] / weights[:sh, :sw]))
+    if scale < 1.0:
+        probabilities = cv2.resize(probabilities, (w, h), interpolation=cv2.INTER_LINEAR)
+    return probabilities
 
 def create_opacity_mask(predicted_mask):
     """
@@ -85,20 +364,27 @@ def create_opacity_mask(predicted_mask):
     opacity_mask[predicted_mask > 0.5] = 100
     return opacity_mask
 
+def resize_mask(predicted_mask, image_shape):
+    """Stretch the opacity mask to 0-255 and resize it to the (h, w) of the original image."""
+    if predicted_mask.max() > 0:
+        predicted_mask = (predicted_mask / predicted_mask.max() * 255).astype(np.uint8)
+
+    h, w = image_shape[:2]
+    return cv2.resize(predicted_mask, (w, h), interpolation=cv2.INTER_NEAREST)
+
 def save_results(original_image, predicted_mask, output_path, relative_output_path):
     """Save the original image and predicted mask to the output directory."""
+    resized_mask = resize_mask(predicted_mask, original_image.shape)
+    save_image_and_mask(original_image, resized_mask, output_path, relative_output_path)
+
+def save_image_and_mask(original_image, resized_mask, output_path, relative_output_path):
+    """Save the original image and a full-resolution mask under output_path/images and output_path/masks."""
     images_output_dir = os.path.join(output_path, "images", os.path.dirname(relative_output_path))
     masks_output_dir = os.path.join(output_path, "masks", os.path.dirname(relative_output_path))
 
     os.makedirs(images_output_dir, exist_ok=True)
     os.makedirs(masks_output_dir, exist_ok=True)
 
-    if predicted_mask.max() > 0:
-        predicted_mask = (predicted_mask / predicted_mask.max() * 255).astype(np.uint8)
-
-    h, w = original_image.shape[:2]
-    resized_mask = cv2.resize(predicted_mask, (w, h), interpolation=cv2.INTER_NEAREST)
-
     original_image_path = os.path.join(images_output_dir, os.path.basename(relative_output_path))
     Image.fromarray(original_image).save(original_image_path, format="PNG")
 
@@ -139,42 +425,118 @@ def convert_to_png(image_path):
         print(f"Error converting image {display_path}: {e}")
         return image_path, False
 
-def process_directory_recursively(input_dir, output_dir, model):
+def collect_images(input_dir):
+    """List every image under input_dir."""
+    paths = []
+    for root, _, files in os.walk(input_dir):
+        for file in sorted(files):
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                paths.append(os.path.join(root, file))
+    return paths
+
+def process_directory_recursively(input_dir, output_dir, model, batch_size=1, num_workers=2, tile_options=None):
+    """
+    Segment every image under input_dir.
+
+    Images are decoded and preprocessed by a pool of threads one batch ahead of
+    the model, batch_size images share a forward pass, and masks are saved by a
+    second pool so the device does not wait on disk. With tile_options (keyword
+    arguments for predict_mask_tiled) every image is segmented at native
+    resolution with overlapping tiles instead.
+    """
     temp_files = []
     
     workspace_root = os.environ.get('WORKSPACE_ROOT', '')
-    
+
+    def get_display_path(image_path):
+        if workspace_root and image_path.startswith(workspace_root):
+            return image_path[len(workspace_root):].lstrip(os.sep)
+        return image_path
+
+    items = []
+    for root, _, files in os.walk(input_dir):
+        relative_path = os.path.relpath(root, input_dir)
+        output_subdir = os.path.join(output_dir, relative_path)
+        os.makedirs(output_subdir, exist_ok=True)
+
+        for file in files:
+            if file.lower().endswith(IMAGE_EXTENSIONS):
+                output_filename = os.path.splitext(file)[0] + '.png'
+                items.append((os.path.join(root, file), os.path.join(relative_path, output_filename)))
+
+    def load(image_path):
+        # Convert to PNG if needed
+        png_path, is_temp = convert_to_png(image_path)
+        if is_temp:
+            temp_files.append(png_path)
+        if tile_options is not None:
+            image = cv2.imread(png_path)
+            if image is None:
+                raise ValueError(f"Failed to load image: {png_path}")
+            return cv2.cvtColor(image, cv2.COLOR_BGR2RGB), None
+        return preprocess_image(png_path, device="cpu")
+
+    def save(original_image, predicted_mask, relative_output_path, display_path):
+        try:
+            opacity_mask = create_opacity_mask(predicted_mask)
+            save_results(original_image, opacity_mask, output_dir, relative_output_path)
+        except Exception as e:
+            print(f"Error processing {display_path}: {e}")
+
+    batch_size = max(1, batch_size)
+    chunks = [items[i:i + batch_size] for i in range(0, len(items), batch_size)]
+    loader = ThreadPoolExecutor(max_workers=num_workers)
+    writer = ThreadPoolExecutor(max_workers=num_workers)
+    pending_writes = deque()
+
+    def submit_loads(chunk):
+        return [(item, loader.submit(load, item[0])) for item in chunk]
+
     try:
-        for root, _, files in os.walk(input_dir):
-            relative_path = os.path.relpath(root, input_dir)
-            output_subdir = os.path.join(output_dir, relative_path)
-            os.makedirs(output_subdir, exist_ok=True)
-
-            for file in files:
-                if file.lower().endswith(('.png', '.jpg', '.jpeg', '.webp')):
-                    image_path = os.path.join(root, file)
-                    try:
-                        # Convert to PNG if needed
-                        png_path, is_temp = convert_to_png(image_path)
-                        if is_temp:
-                            temp_files.append(png_path)
-                        
-                        display_path = image_path
-                        if workspace_root and image_path.startswith(workspace_root):
-                            display_path = image_path[len(workspace_root):].lstrip(os.sep)
-                        
-                        print(f"Processing: {display_path}")
-                        original_image, tensor_image = preprocess_image(png_path)
-                        predicted_mask = predict_mask(model, tensor_image)
-
-                        opacity_mask = create_opacity_mask(predicted_mask)
-
-                        output_filename = os.path.splitext(file)[0] + '.png'
-                        save_results(original_image, opacity_mask, output_dir, 
-                                    os.path.join(relative_path, output_filename))
-                    except Exception as e:
-                        print(f"Error processing {display_path}: {e}")
+        loaded = submit_loads(chunks[0]) if chunks else []
+        for index in range(len(chunks)):
+            current = loaded
+            # Start decoding the next batch while this one runs on the device
+            loaded = submit_loads(chunks[index + 1]) if index + 1 < len(chunks) else []
+
+            batch = []
+            for (image_path, relative_output_path), future in current:
+                display_path = get_display_path(image_path)
+                print(f"Processing: {display_path}")
+                try:
+                    original_image, tensor_image = future.result()
+                    batch.append((original_image, tensor_image, relative_output_path, display_path))
+                except Exception as e:
+                    print(f"Error processing {display_path}: {e}")
+
+            if not batch:
+                continue
+
+            try:
+                if tile_options is not None:
+                    predicted_masks = [predict_mask_tiled(model, original_image, **tile_options)
+                                       for original_image, _, _, _ in batch]
+                else:
+                    tensor_images = torch.cat([tensor_image for _, tensor_image, _, _ in batch]).to(DEVICE)
+                    predicted_masks = predict_masks(model, tensor_images)
+            except Exception as e:
+                for _, _, _, display_path in batch:
+                    print(f"Error processing {display_path}: {e}")
+                continue
+
+            for (original_image, _, relative_output_path, display_path), predicted_mask in zip(batch, predicted_masks):
+                pending_writes.append(writer.submit(save, original_image, predicted_mask,
+                                                    relative_output_path, display_path))
+
+            # Keep at most two batches of decoded images waiting for the writers
+            while len(pending_writes) > 2 * batch_size:
+                pending_writes.popleft().result()
+
+        while pending_writes:
+            pending_writes.popleft().result()
     finally:
+        loader.shutdown(wait=True)
+        writer.shutdown(wait=True)
         # Clean up any temporary files
         for temp_file in temp_files:
             try:
@@ -182,9 +544,10 @@ def process_directory_recursively(input_dir, output_dir, model):
             except:
                 pass
 
-def run_inference(model_path, model_type, base_input_dir, output_dir):
+def run_inference(model_path, model_type, base_input_dir, output_dir, batch_size=1, num_workers=2, tile_options=None,
+                  precision="fp32", channels_last=False, use_compiled=True):
     """Run inference on all images in the input directory."""
-    model = load_model(model_path)
+    model = load_model(model_path, precision=precision, channels_last=channels_last, use_compiled=use_compiled)
 
     input_dir = get_input_dir(model_type, base_input_dir)
     # print(f"Using input directory: {input_dir}")
@@ -195,7 +558,8 @@ def run_inference(model_path, model_type, base_input_dir, output_dir):
         print(f"Please place input images in {input_dir}")
         return
 
-    process_directory_recursively(input_dir, output_dir, model)
+    process_directory_recursively(input_dir, output_dir, model, batch_size=batch_size, num_workers=num_workers,
+                                  tile_options=tile_options)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Run segmentation inference.")
@@ -218,7 +582,79 @@ if __name__ == "__main__":
         default=DEFAULT_OUTPUT_DIR,
         help="Output directory for segmentation results"
     )
+    parser.add_argument(
+        "--batch_size",
+        type=int,
+        default=1,
+        help="Number of images segmented in one forward pass"
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=2,
+        help="Threads used to decode images ahead of the model and to save the results"
+    )
+    parser.add_argument(
+        "--tiled",
+        action="store_true",
+        help="Segment at native resolution with overlapping tiles instead of resizing to 1024x1024"
+    )
+    parser.add_argument(
+        "--tile_overlap",
+        type=int,
+        default=TILE_OVERLAP,
+        help="Overlap in pixels between neighbouring tiles"
+    )
+    parser.add_argument(
+        "--max_tiles",
+        type=int,
+        default=MAX_TILES,
+        help="Max tiles per image, larger images are downscaled to fit (0 for no limit)"
+    )
+    parser.add_argument(
+        "--precision",
+        type=str,
+        default="fp32",
+        choices=PRECISIONS,
+        help="Inference precision, bf16 and fp16 run under autocast (fp16 needs CUDA)"
+    )
+    parser.add_argument(
+        "--channels_last",
+        action="store_true",
+        help="Run the model in channels-last memory format"
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=0,
+        help="CPU threads used by torch and OpenCV, 0 keeps their defaults (all cores)"
+    )
+    parser.add_argument(
+        "--export",
+        action="store_true",
+        help="Compile the model with TorchScript, save it next to the weights and exit"
+    )
+    parser.add_argument(
+        "--eager",
+        action="store_true",
+        help="Ignore the compiled model and run the eager one"
+    )
     args = parser.parse_args()
 
+    if args.threads > 0:
+        torch.set_num_threads(args.threads)
+        cv2.setNumThreads(args.threads)
+
     model_path = MODEL_PATHS[args.model_type]
-    run_inference(model_path, args.model_type, args.input_dir, args.output_dir)
\ No newline at end of file
+    if args.export:
+        print(f"Exporting {model_path} for {DEVICE}")
+        print(f"Saved compiled model: "
+              f"{export_model(model_path, channels_last=args.channels_last, precision=args.precision)}")
+        raise SystemExit(0)
+
+    tile_options = None
+    if args.tiled:
+        tile_options = {"overlap": args.tile_overlap, "max_tiles": args.max_tiles, "batch_size": args.batch_size}
+    run_inference(model_path, args.model_type, args.input_dir, args.output_dir,
+                  batch_size=args.batch_size, num_workers=args.num_workers, tile_options=tile_options,
+                  precision=args.precision, channels_last=args.channels_last, use_compiled=not args.eager)
\ No newline at end of file
@@ -0,0 +1,129 @@
+import os
+import time
+import argparse
+
+import numpy as np
+import torch
+
+from run_segmentation import (
+    AUTOCAST_DTYPES, DEVICE, MODEL_PATHS, PRECISIONS, CompiledSegmenter, collect_images, forward_dtype, load_model,
+    preprocess_image, predict_mask, create_opacity_mask
+)
+
+def mask_iou(mask_a, mask_b):
+    """Intersection over union of two boolean masks, 1.0 when both are empty."""
+    union = np.logical_or(mask_a, mask_b).sum()
+    if union == 0:
+        return 1.0
+    return np.logical_and(mask_a, mask_b).sum() / union
+
+def timed_predict(model, tensor_image):
+    """Predict a mask and return it with the forward time in ms."""
+    start = time.perf_counter()
+    predicted_mask = predict_mask(model, tensor_image)
+    return predicted_mask, (time.perf_counter() - start) * 1000
+
+def check_precision(model):
+    """
+    Check that the model really runs at the precision it was loaded with.
+
+    predict_mask casts the logits to fp32, so masks alone cannot tell whether
+    autocast reached the convolutions, e.g. of a frozen TorchScript graph.
+    """
+    expected = AUTOCAST_DTYPES.get(model.precision, torch.float32)
+    dtype = forward_dtype(model)
+    kind = "compiled" if isinstance(model, CompiledSegmenter) else "eager"
+    print(f"{kind} model at {model.precision}: forward dtype {dtype}")
+    if dtype != expected:
+        raise RuntimeError(f"The {kind} model runs in {dtype}, expected {expected} for {model.precision}")
+    return dtype
+
+def validate(model_path, input_dir, precision, channels_last=False, threshold=0.5):
+    """
+    Compare masks predicted at the given precision against fp32 on every image under input_dir.
+
+    The reference is always the eager fp32 model, the compared model uses the
+    compiled artifact when one has been exported. Raises if the compared model
+    does not actually run in the dtype of the requested precision.
+
+    Returns a list of (image_path, iou, opacity_iou, fp32_ms, ms) where iou compares
+    the masks binarized at threshold and opacity_iou compares every opacity level
+    produced by create_opacity_mask.
+    """
+    reference = load_model(model_path, use_compiled=False)
+    candidate = load_model(model_path, precision=precision, channels_last=channels_last)
+    check_precision(candidate)
+
+    results = []
+    for image_path in collect_images(input_dir):
+        try:
+            _, tensor_image = preprocess_image(image_path)
+        except ValueError as e:
+            print(e)
+            continue
+
+        reference_mask, reference_ms = timed_predict(reference, tensor_image)
+        candidate_mask, candidate_ms = timed_predict(candidate, tensor_image)
+
+        iou = mask_iou(reference_mask > threshold, candidate_mask > threshold)
+        reference_levels = create_opacity_mask(reference_mask)
+        candidate_levels = create_opacity_mask(candidate_mask)
+        opacity_iou = np.mean([mask_iou(reference_levels == level, candidate_levels == level)
+                               for level in (50, 75, 100)])
+        results.append((image_path, iou, opacity_iou, reference_ms, candidate_ms))
+        print(f"{os.path.relpath(image_path, input_dir)}: IoU {iou:.4f}, opacity IoU {opacity_iou:.4f}, "
+              f"fp32 {reference_ms:.0f} ms, {precision} {candidate_ms:.0f} ms")
+    return results
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Report the mask IoU of a reduced-precision segmentation run against fp32.")
+    parser.add_argument(
+        "--model_type",
+        type=str,
+        required=True,
+        choices=MODEL_PATHS.keys(),
+        help="Specify the model type to use. Options: 'black_bars', 'white_bars', etc."
+    )
+    parser.add_argument(
+        "--input_dir",
+        type=str,
+        required=True,
+        help="Folder of images to compare on (searched recursively)"
+    )
+    parser.add_argument(
+        "--precision",
+        type=str,
+        default="bf16",
+        choices=[precision for precision in PRECISIONS if precision != "fp32"],
+        help="Precision compared against fp32"
+    )
+    parser.add_argument(
+        "--channels_last",
+        action="store_true",
+        help="Run the compared model in channels-last memory format"
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=0.5,
+        help="Probability above which a pixel counts as censored"
+    )
+    args = parser.parse_args()
+
+    print(f"Device: {DEVICE}")
+    results = validate(MODEL_PATHS[args.model_type], args.input_dir, args.precision,
+                       channels_last=args.channels_last, threshold=args.threshold)
+    if not results:
+        print(f"No images found in {args.input_dir}")
+    else:
+        ious = np.array([iou for _, iou, _, _, _ in results])
+        opacity_ious = np.array([opacity_iou for _, _, opacity_iou, _, _ in results])
+        # Skip the first image, it includes the one-off allocator and kernel setup
+        timed = results[1:] or results
+        reference_ms = np.mean([ms for _, _, _, ms, _ in timed])
+        candidate_ms = np.mean([ms for _, _, _, _, ms in timed])
+        print(f"Images: {len(results)}")
+        print(f"IoU vs fp32: mean {ious.mean():.4f}, min {ious.min():.4f} (delta {1 - ious.mean():.4f})")
+        print(f"Opacity IoU vs fp32: mean {opacity_ious.mean():.4f}, min {opacity_ious.min():.4f}")
+        print(f"Mean forward time: fp32 {reference_ms:.0f} ms, {args.precision} {candidate_ms:.0f} ms "
+              f"({reference_ms / max(candidate_ms, 1e-6):.2f}x)")
@@ -0,0 +1,92 @@
+import os
+import itertools
+import queue
+import threading
+from concurrent.futures import Future
+
+from pipeline import CameliaPipeline, MODEL_TYPES, SEGMENTATION_ROOT, get_relative_path
+import run_segmentation
+
+# Lower values run first; jobs with equal priority run in submission order
+PRIORITY_INTERACTIVE = 0
+PRIORITY_BATCH = 10
+
+
+class PipelineWorker:
+    """
+    Long-lived worker pool that owns a CameliaPipeline and runs jobs from a local queue.
+
+    Jobs are callables taking the pipeline as first argument, e.g.
+    ``worker.submit(CameliaPipeline.inpaint, image, mask)``. Up to max_jobs of
+    them run at once on worker threads sharing the same resident models; the
+    rest wait in a priority queue, FIFO within the same priority.
+    """
+
+    def __init__(self, pipeline=None, log=None, max_jobs=1, **pipeline_kwargs):
+        self.pipeline = pipeline or CameliaPipeline(log=log, **pipeline_kwargs)
+        self.log = self.pipeline.log
+        self.max_jobs = max(1, max_jobs)
+        self.jobs = queue.PriorityQueue()
+        self._counter = itertools.count()
+        self.threads = []
+        for index in range(self.max_jobs):
+            thread = threading.Thread(target=self._run, name=f"camelia-worker-{index}", daemon=True)
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, fn, *args, priority=PRIORITY_BATCH, **kwargs):
+        """Queue fn(pipeline, *args, **kwargs) and return a Future with its result."""
+        future = Future()
+        self.jobs.put((priority, next(self._counter), (future, fn, args, kwargs)))
+        return future
+
+    def run(self, fn, *args, **kwargs):
+        """Queue a job and block until it finishes."""
+        return self.submit(fn, *args, **kwargs).result()
+
+    def pending(self):
+        """Number of jobs waiting for a free worker."""
+        return self.jobs.qsize()
+
+    def preload(self, model_types=MODEL_TYPES, warmup=True):
+        """
+        Queue loading of the inpainting model and every available segmentation model.
+
+        With warmup, the loaded models are then run once at their input shapes
+        and the inpainting shape buckets (see CameliaPipeline.warmup).
+        """
+        def load(pipeline):
+            pipeline.get_inpaint_model()
+            loaded = []
+            for model_type in model_types:
+                model_path = os.path.join(SEGMENTATION_ROOT, run_segmentation.MODEL_PATHS[model_type])
+                if not os.path.exists(model_path):
+                    self.log(f"Skipping preload, model not found: {get_relative_path(model_path)}")
+                    continue
+                pipeline.get_segmentation_model(model_type)
+                loaded.append(model_type)
+            self.log("Models loaded")
+            if warmup:
+                pipeline.warmup(loaded)
+        return self.submit(load, priority=PRIORITY_INTERACTIVE)
+
+    def stop(self):
+        """Finish the queued jobs and stop the worker threads."""
+        for _ in self.threads:
+            self.jobs.put((float("inf"), next(self._counter), None))
+        for thread in self.threads:
+            thread.join()
+
+    def _run(self):
+        while True:
+            _, _, job = self.jobs.get()
+            if job is None:
+                break
+
+            future, fn, args, kwargs = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(fn(self.pipeline, *args, **kwargs))
+            except BaseException as e:
+                future.set_exception(e)